@@ -0,0 +1,82 @@
+"""Prompt tokens per message against the length of the chat, with and without memory.
+
+Usage: python -m benchmarks.chat_memory [--turns 100] [--report 1,5,10,20,50,100]
+                                        [--latency 0.2] [--turns-kept 6]
+
+One simulated user sends --turns messages to a local fake OpenAI endpoint.
+Each message is sent three ways: alone, as before (none); after the whole
+chat history (full); and through ConversationMemory (memory), whose summary
+refreshes run in the background while the next message is sent. Prints one
+JSON object per --report turn, with the prompt tokens of that message and the
+mean for each way, plus the memory counters.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+
+# every prompt is different, the cache would only hide the fake's latency
+os.environ.setdefault("RESPONSE_CACHE_SIZE", "0")
+
+from benchmarks.fake_openai import FakeOpenAI  # noqa: E402
+from bot.memory import ConversationMemory  # noqa: E402
+from bot.tokens import count_message_tokens  # noqa: E402
+from bot.utilities import chat, getOpenAiClient  # noqa: E402
+from config import OPENAI_MODEL  # noqa: E402
+
+TOPICS = "the trip to Lisbon, the budget for March, the new intern, the server migration".split(", ")
+WORDS = "could you remind me what we said about and also check whether the plan still works".split()
+
+
+def message(rnd: random.Random, turn: int) -> str:
+    return f"Message {turn} about {rnd.choice(TOPICS)}: " + " ".join(rnd.choice(WORDS) for _ in range(30))
+
+
+async def run(args) -> None:
+    fake = FakeOpenAI(latency=args.latency, token_delay=0.0)
+    await fake.start()
+    client = getOpenAiClient("benchmark", base_url=fake.base_url)
+    memory = ConversationMemory(args.turns_kept, args.recent_tokens, args.summary_tokens)
+    report = {int(turn) for turn in args.report.split(",")}
+    rnd = random.Random(0)
+    chat_data: dict = {}
+    history: list = []
+    totals = {"none": 0, "full": 0, "memory": 0}
+    try:
+        for turn in range(1, args.turns + 1):
+            text = message(rnd, turn)
+            prompts = {
+                "none": [{"role": "user", "content": text}],
+                "full": history + [{"role": "user", "content": text}],
+                "memory": memory.messages(chat_data, text),
+            }
+            tokens = {way: count_message_tokens(prompt, OPENAI_MODEL) for way, prompt in prompts.items()}
+            for way, count in tokens.items():
+                totals[way] += count
+            answer = await chat(MSGS=prompts["memory"], MaxToken=200, client=client, user_id=1)
+            history += [{"role": "user", "content": text}, {"role": "assistant", "content": answer}]
+            memory.record(1, chat_data, text, answer, client, 1)
+            if turn in report:
+                print(json.dumps({"turn": turn, "prompt_tokens": tokens,
+                                  "mean_prompt_tokens": {way: round(total / turn, 1)
+                                                         for way, total in totals.items()},
+                                  "memory": memory.stats()}))
+        await memory.wait()
+    finally:
+        await fake.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--report", default="1,5,10,20,50,100")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake OpenAI time to answer")
+    parser.add_argument("--turns-kept", type=int, default=6)
+    parser.add_argument("--recent-tokens", type=int, default=1500)
+    parser.add_argument("--summary-tokens", type=int, default=300)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Import time and RSS of the bot process when it is ready to answer /start.
+
+Usage: python -m benchmarks.cold_start [--runs 5] [--max-import-seconds S] [--max-rss-mb M]
+
+Each run starts a fresh interpreter that imports main and builds the
+Application (no network). Prints a JSON summary and exits with status 1 when
+a --max-* threshold is exceeded, so CI can catch regressions.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.build_application("123456:benchmark")
+ready = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "ready_seconds": ready - started,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy_modules": [m for m in ("torch", "whisper", "speech_recognition", "pydub") if m in sys.modules],
+}))
+"""
+
+
+def probe() -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-seconds", type=float)
+    parser.add_argument("--max-rss-mb", type=float)
+    args = parser.parse_args()
+
+    runs = [probe() for _ in range(args.runs)]
+    result = {
+        "runs": args.runs,
+        "import_seconds_median": round(statistics.median(r["import_seconds"] for r in runs), 4),
+        "ready_seconds_median": round(statistics.median(r["ready_seconds"] for r in runs), 4),
+        "rss_mb_max": round(max(r["rss_mb"] for r in runs), 1),
+        "heavy_modules": runs[-1]["heavy_modules"],
+    }
+    print(json.dumps(result))
+
+    failed = (
+        (args.max_import_seconds is not None and result["import_seconds_median"] > args.max_import_seconds)
+        or (args.max_rss_mb is not None and result["rss_mb_max"] > args.max_rss_mb)
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
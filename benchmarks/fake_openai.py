@@ -0,0 +1,98 @@
+"""A local stand-in for the OpenAI chat completions endpoint.
+
+Answers POST /v1/chat/completions, streamed or not, after a configurable
+delay, so load tests measure the bot rather than the network. Point the bot
+at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+"""
+import asyncio
+import itertools
+import json
+import time
+from typing import Optional
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+
+class FakeOpenAI:
+    """`latency` is the time to the first token, `token_delay` the gap between streamed tokens."""
+
+    def __init__(self, latency: float = 0.5, token_delay: float = 0.02, answer_tokens: int = 40):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.answer_tokens = answer_tokens
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._ids = itertools.count(1)
+        self._server: Optional[HTTPServer] = None
+        self.port: Optional[int] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def start(self, port: int = 0) -> int:
+        sockets = bind_sockets(port, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        self._server = HTTPServer(tornado.web.Application([
+            (r"/v1/chat/completions", _CompletionsHandler, {"fake": self}),
+        ]))
+        self._server.add_sockets(sockets)
+        return self.port
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.stop()
+            await self._server.close_all_connections()
+
+    def answer(self, request: dict) -> list:
+        prompt = request["messages"][-1]["content"]
+        words = prompt.split()[-self.answer_tokens:] or ["ok"]
+        return [f"{word} " for word in words]
+
+    def completion(self, request: dict, tokens: list) -> dict:
+        return {
+            "id": f"chatcmpl-{next(self._ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{"index": i, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "".join(tokens)}}
+                        for i in range(int(request.get("n") or 1))],
+            "usage": {"prompt_tokens": len(request["messages"][-1]["content"].split()),
+                      "completion_tokens": len(tokens),
+                      "total_tokens": len(request["messages"][-1]["content"].split()) + len(tokens)},
+        }
+
+
+class _CompletionsHandler(tornado.web.RequestHandler):
+    def initialize(self, fake: FakeOpenAI) -> None:
+        self.fake = fake
+
+    async def post(self) -> None:
+        fake = self.fake
+        request = json.loads(self.request.body)
+        fake.requests += 1
+        fake.in_flight += 1
+        fake.peak_in_flight = max(fake.peak_in_flight, fake.in_flight)
+        try:
+            tokens = fake.answer(request)
+            await asyncio.sleep(fake.latency)
+            if not request.get("stream"):
+                self.write(fake.completion(request, tokens))
+                return
+            self.set_header("Content-Type", "text/event-stream")
+            completion_id = f"chatcmpl-{next(fake._ids)}"
+            for index, token in enumerate(tokens):
+                if index:
+                    await asyncio.sleep(fake.token_delay)
+                chunk = {"id": completion_id, "object": "chat.completion.chunk",
+                         "created": int(time.time()), "model": request.get("model", "fake"),
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                self.write(f"data: {json.dumps(chunk)}\n\n")
+                await self.flush()
+            self.write("data: [DONE]\n\n")
+        finally:
+            fake.in_flight -= 1
@@ -0,0 +1,193 @@
+"""A local stand-in for the Telegram Bot API.
+
+Implements the handful of methods the bot uses (getMe, getUpdates, setWebhook,
+sendMessage, editMessageText, getFile, ...) plus file downloads, records every
+call, and lets a driver inject updates. Point the bot at it with
+TELEGRAM_BASE_URL=http://127.0.0.1:<port>/bot and
+TELEGRAM_BASE_FILE_URL=http://127.0.0.1:<port>/file/bot.
+"""
+import asyncio
+import itertools
+import json
+import time
+from typing import Callable, Dict, List, Optional
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.calls: List[dict] = []
+        # called with every recorded call, cheaper than wait_for_call for many waiters
+        self.observers: List[Callable[[dict], None]] = []
+        self.files: Dict[str, bytes] = {}
+        self._updates: List[dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._changed = asyncio.Condition()
+        self._server: Optional[HTTPServer] = None
+        self.port: Optional[int] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/file/bot"
+
+    async def start(self, port: int = 0) -> int:
+        sockets = bind_sockets(port, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        self._server = HTTPServer(tornado.web.Application([
+            (r"/bot[^/]+/(\w+)", _MethodHandler, {"fake": self}),
+            (r"/file/bot[^/]+/(.+)", _FileHandler, {"fake": self}),
+        ]))
+        self._server.add_sockets(sockets)
+        return self.port
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.stop()
+            await self._server.close_all_connections()
+
+    # updates -------------------------------------------------------------
+
+    async def push_update(self, update: dict) -> dict:
+        update = {"update_id": next(self._update_ids), **update}
+        async with self._changed:
+            self._updates.append(update)
+            self._changed.notify_all()
+        return update
+
+    async def wait_for_call(self, predicate: Callable[[dict], bool], after: int = 0,
+                            timeout: float = 30.0) -> dict:
+        """Wait for a recorded call matching `predicate`, looking at calls[after:]."""
+        async def wait() -> dict:
+            async with self._changed:
+                while True:
+                    for call in self.calls[after:]:
+                        if predicate(call):
+                            return call
+                    await self._changed.wait()
+        return await asyncio.wait_for(wait(), timeout)
+
+    # Bot API methods -----------------------------------------------------
+
+    async def call(self, method: str, params: dict) -> object:
+        record = {"method": method, "params": params, "time": time.monotonic()}
+        async with self._changed:
+            self.calls.append(record)
+            self._changed.notify_all()
+        for observer in self.observers:
+            observer(record)
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params)
+        if method == "getFile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": file_id,
+                    "file_size": len(self.files.get(file_id, b"")), "file_path": f"voice/{file_id}.ogg"}
+        # setWebhook, deleteWebhook, deleteMessage, answerCallbackQuery, ...
+        return True
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        async with self._changed:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    break
+            return list(self._updates)
+
+    def _message(self, params: dict) -> dict:
+        message_id = params.get("message_id") or next(self._message_ids)
+        message = {
+            "message_id": int(message_id),
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        if "reply_markup" in params:
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, fake: FakeTelegram) -> None:
+        self.fake = fake
+
+    async def post(self, method: str) -> None:
+        if self.request.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(self.request.body or b"{}")
+        else:
+            # python-telegram-bot sends form fields whose non-string values are json encoded
+            params = {}
+            for key in self.request.body_arguments:
+                value = self.get_body_argument(key)
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+        result = await self.fake.call(method, params)
+        self.write({"ok": True, "result": result})
+
+
+class _FileHandler(tornado.web.RequestHandler):
+    def initialize(self, fake: FakeTelegram) -> None:
+        self.fake = fake
+
+    def get(self, path: str) -> None:
+        file_id = path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        if file_id not in self.fake.files:
+            raise tornado.web.HTTPError(404)
+        self.write(self.fake.files[file_id])
+
+
+# update builders ---------------------------------------------------------
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def _chat(user_id: int) -> dict:
+    return {"id": user_id, "type": "private"}
+
+
+_incoming_ids = itertools.count(1)
+
+
+def text_update(user_id: int, text: str) -> dict:
+    message = {"message_id": next(_incoming_ids), "date": int(time.time()), "chat": _chat(user_id),
+               "from": _user(user_id), "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": message}
+
+
+def voice_update(user_id: int, file_id: str, duration: int = 5) -> dict:
+    return {"message": {
+        "message_id": next(_incoming_ids), "date": int(time.time()), "chat": _chat(user_id),
+        "from": _user(user_id),
+        "voice": {"file_id": file_id, "file_unique_id": file_id, "duration": duration,
+                  "mime_type": "audio/ogg"},
+    }}
+
+
+def callback_update(user_id: int, data: str, message: dict) -> dict:
+    return {"callback_query": {
+        "id": str(next(_incoming_ids)), "from": _user(user_id), "chat_instance": str(user_id),
+        "data": data, "message": message,
+    }}
@@ -0,0 +1,241 @@
+"""Offline load test of the /question conversation.
+
+Usage: python -m benchmarks.load_test [--users 50] [--rounds 1] [--voice-share 0.5]
+                                      [--openai-latency 0.5] [--output report.json]
+
+Boots the real Application from main.py in polling mode against the fake
+Telegram Bot API and the fake OpenAI endpoint. Every simulated user goes
+through /question -> a text or a data/*.ogg voice question ->
+"Transcription + summary" -> Back -> END, all users at the same time. Prints
+a JSON report with p50/p95/p99 per step, updates/sec and the peak RSS of the
+process (bot and fakes together), meant to be compared across commits.
+
+The transcription and response caches are disabled unless the environment
+sets them, so every user costs a real transcription and a completion.
+"""
+import argparse
+import asyncio
+import glob
+import importlib.util
+import json
+import logging
+import os
+import random
+import resource
+import socket
+import sys
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "data")
+STEPS = ("question", "ask", "summary", "back", "end")
+SUMMARY = chr(13)  # SHOWING_TRANSCRIPTION_SUMMARY in bot.question_command
+END = "-1"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+def summarize(values: List[float], errors: int) -> dict:
+    return {
+        "count": len(values),
+        "errors": errors,
+        "p50_ms": _ms(percentile(values, 0.50)),
+        "p95_ms": _ms(percentile(values, 0.95)),
+        "p99_ms": _ms(percentile(values, 0.99)),
+        "max_ms": _ms(max(values) if values else None),
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+class StepTimeout(Exception):
+    pass
+
+
+class LoadTest:
+    def __init__(self, fake, users: int, rounds: int, voice_share: float, timeout: float,
+                 voices: List[bytes]):
+        self.fake = fake
+        self.users = users
+        self.rounds = rounds
+        self.voice_share = voice_share
+        self.timeout = timeout
+        self.voices = voices
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.updates = 0
+        # chat id -> bot calls not consumed by that user's flow yet
+        self._inbox: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        fake.observers.append(self._observe)
+
+    def _observe(self, call: dict) -> None:
+        chat_id = call["params"].get("chat_id")
+        if chat_id is not None:
+            self._inbox[int(chat_id)].put_nowait(call)
+
+    async def step(self, name: str, user_id: int, update: dict,
+                   done: Callable[[dict], bool], ok: Callable[[dict], bool] = lambda call: True) -> dict:
+        """Push `update` and wait for the bot call that ends the step."""
+        inbox = self._inbox[user_id]
+        started = time.monotonic()
+        await self.fake.push_update(update)
+        self.updates += 1
+        deadline = started + self.timeout
+        while True:
+            try:
+                call = await asyncio.wait_for(inbox.get(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                self.errors[name] += 1
+                raise StepTimeout(name)
+            if done(call):
+                break
+        if not ok(call):
+            self.errors[name] += 1
+            raise StepTimeout(name)
+        self.latencies[name].append(call["time"] - started)
+        return call
+
+    async def user(self, user_id: int) -> None:
+        from benchmarks.fake_telegram import text_update, voice_update, callback_update
+
+        rnd = random.Random(user_id)
+        for round_ in range(self.rounds):
+            started = time.monotonic()
+            try:
+                await self.step("question", user_id, text_update(user_id, "/question"),
+                                lambda c: c["method"] == "sendMessage"
+                                and c["params"].get("text", "").startswith("We are waiting"))
+                if self.voices and rnd.random() < self.voice_share:
+                    file_id = f"voice-{user_id}-{round_}"
+                    self.fake.files[file_id] = rnd.choice(self.voices)
+                    question = voice_update(user_id, file_id)
+                else:
+                    question = text_update(user_id, f"User {user_id} asks question {round_}: how do "
+                                                    "I keep my notes and reminders in sync?")
+                menu = await self.step("ask", user_id, question,
+                                       lambda c: c["method"] == "sendMessage"
+                                       and not c["params"].get("text", "").startswith("Processing"),
+                                       lambda c: "reply_markup" in c["params"])
+                message = {"message_id": 1, "date": int(time.time()),
+                           "chat": {"id": user_id, "type": "private"}, "text": menu["params"]["text"]}
+                await self.step("summary", user_id, callback_update(user_id, SUMMARY, message),
+                                lambda c: c["method"] == "editMessageText" and "reply_markup" in c["params"])
+                await self.step("back", user_id, callback_update(user_id, END, message),
+                                lambda c: c["method"] == "editMessageText" and "reply_markup" in c["params"])
+                await self.step("end", user_id, callback_update(user_id, END, message),
+                                lambda c: c["method"] == "editMessageText"
+                                and c["params"].get("text") == "See you around!")
+            except StepTimeout:
+                self.errors["flow"] += 1
+                # start the next round from a clean conversation
+                await self.fake.push_update(text_update(user_id, "/stop"))
+                continue
+            self.latencies["flow"].append(time.monotonic() - started)
+
+    def report(self) -> dict:
+        return {name: summarize(self.latencies[name], self.errors[name]) for name in STEPS + ("flow",)}
+
+
+async def run(args) -> dict:
+    from benchmarks.fake_openai import FakeOpenAI
+    from benchmarks.fake_telegram import FakeTelegram
+
+    openai = FakeOpenAI(args.openai_latency, args.token_delay)
+    await openai.start(int(os.environ["OPENAI_BASE_URL"].rsplit(":", 1)[1].split("/")[0]))
+    fake = FakeTelegram()
+    await fake.start()
+
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+
+    voices = []
+    if args.voice_share > 0:
+        for path in sorted(glob.glob(os.path.join(DATA_DIR, "*.ogg"))):
+            with open(path, "rb") as f:
+                voices.append(f.read())
+
+    application = main.build_application("123456:load", fake.base_url, fake.base_file_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    await application.updater.start_polling(poll_interval=0.0, timeout=10)
+
+    test = LoadTest(fake, args.users, args.rounds, args.voice_share, args.step_timeout, voices)
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(test.user(10000 + i) for i in range(args.users)))
+        elapsed = time.monotonic() - started
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+        await fake.stop()
+        await openai.stop()
+
+    return {
+        "config": {
+            "users": args.users,
+            "rounds": args.rounds,
+            "voice_share": args.voice_share,
+            "openai_latency": args.openai_latency,
+            "token_delay": args.token_delay,
+        },
+        "steps": test.report(),
+        "updates": test.updates,
+        "duration_s": round(elapsed, 3),
+        "updates_per_second": round(test.updates / elapsed, 2),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "openai": {"requests": openai.requests, "peak_in_flight": openai.peak_in_flight},
+        "passed": not any(test.errors.values()),
+    }
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--voice-share", type=float, default=0.5,
+                        help="share of the questions sent as voice messages (needs whisper)")
+    parser.add_argument("--openai-latency", type=float, default=0.5,
+                        help="seconds the fake OpenAI takes to the first token")
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--step-timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+    if args.voice_share > 0 and importlib.util.find_spec("whisper") is None:
+        parser.error("voice questions need openai-whisper installed, or pass --voice-share 0")
+
+    # before config.py is imported by main
+    os.environ.setdefault("CHATGPT_API", "load-test")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{free_port()}/v1"
+    os.environ.setdefault("WHISPER_PRELOAD", "startup" if args.voice_share > 0 else "lazy")
+    os.environ.setdefault("TRANSCRIPTION_CACHE_BYTES", "0")
+    os.environ.setdefault("RESPONSE_CACHE_SIZE", "0")
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main_()
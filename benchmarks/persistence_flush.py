@@ -0,0 +1,80 @@
+"""Cost of one persistence flush against the number of users.
+
+Usage: python -m benchmarks.persistence_flush [--users 100,1000,10000] [--dirty 0.05]
+
+Every user has a transcription, a summary and a conversation state. A flush
+writes the `--dirty` share of them, the way Application.update_persistence
+does after a burst of updates. SQLitePersistence is compared with PTB's
+PicklePersistence in on_flush mode, which rewrites the whole file each time. Prints one
+JSON object per user count.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from telegram.ext import PersistenceInput, PicklePersistence
+
+from bot.persistence import SQLitePersistence
+
+CONVERSATION = "question_conversation"
+WORDS = "the bot answered your question about the weather and the next meeting".split()
+
+
+def user_data(seed: int) -> dict:
+    rnd = random.Random(seed)
+    text = " ".join(rnd.choice(WORDS) for _ in range(200))
+    return {"transcription": text, "summary": text[:300], "question": None}
+
+
+async def flush(persistence, users: dict) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        coroutine for user_id, data in users.items() for coroutine in (
+            persistence.update_user_data(user_id, data),
+            persistence.update_conversation(CONVERSATION, (user_id, user_id), 3),
+        )
+    ))
+    await persistence.flush()
+    return time.perf_counter() - started
+
+
+async def run(count: int, dirty: float, directory: str) -> dict:
+    everyone = {user_id: user_data(user_id) for user_id in range(1, count + 1)}
+    changed = {user_id: {**everyone[user_id], "summary": "changed"}
+               for user_id in random.Random(count).sample(sorted(everyone), max(1, int(count * dirty)))}
+
+    sqlite = SQLitePersistence(os.path.join(directory, f"{count}.sqlite"))
+    pickle = PicklePersistence(os.path.join(directory, f"{count}.pickle"),
+                               store_data=PersistenceInput(bot_data=False, callback_data=False),
+                               on_flush=True)
+    await pickle.get_user_data()
+    await pickle.get_conversations(CONVERSATION)
+    report = {"users": count, "dirty": len(changed)}
+    for name, persistence in (("sqlite", sqlite), ("pickle", pickle)):
+        full = await flush(persistence, everyone)
+        partial = await flush(persistence, changed)
+        report[name] = {"initial_flush_ms": round(full * 1000, 2),
+                        "dirty_flush_ms": round(partial * 1000, 2)}
+    report["sqlite"]["bytes"] = sum(os.path.getsize(sqlite.path + suffix) for suffix in ("", "-wal")
+                                    if os.path.exists(sqlite.path + suffix))
+    report["pickle"]["bytes"] = os.path.getsize(pickle.filepath)
+    sqlite.close()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="100,1000,10000")
+    parser.add_argument("--dirty", type=float, default=0.05)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        for count in (int(n) for n in args.users.split(",")):
+            print(json.dumps(asyncio.run(run(count, args.dirty, directory))))
+
+
+if __name__ == "__main__":
+    main()
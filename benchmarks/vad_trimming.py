@@ -0,0 +1,70 @@
+"""Audio removed by the silence trimmer and the whisper time it saves.
+
+Usage: python -m benchmarks.vad_trimming [--model tiny] [--repeat 3] [--no-whisper]
+
+For every data/*.ogg voice note prints one JSON object with its duration, the
+seconds removed and, unless --no-whisper is given, the transcription time and
+text of the full and the trimmed audio.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+from bot.audio import SAMPLE_RATE, decode_audio
+from bot.vad import SilenceTrimmer
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "data")
+
+
+def timed_transcribe(model, audio, repeat: int):
+    best, text = None, ""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        text = model.transcribe(audio, fp16=False)["text"]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, text
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-whisper", action="store_true", help="only measure the trimming")
+    args = parser.parse_args()
+
+    model = None
+    if not args.no_whisper:
+        import whisper
+
+        model = whisper.load_model(args.model)
+    trimmer = SilenceTrimmer()
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, "*.ogg"))):
+        with open(path, "rb") as f:
+            audio = decode_audio(f.read())
+        started = time.perf_counter()
+        trimmed = trimmer.trim(audio)
+        report = {
+            "file": os.path.basename(path),
+            "seconds": round(len(audio) / SAMPLE_RATE, 3),
+            "removed_seconds": round((len(audio) - len(trimmed)) / SAMPLE_RATE, 3),
+            "trim_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        if model is not None:
+            full_time, full_text = timed_transcribe(model, audio, args.repeat)
+            trimmed_time, trimmed_text = timed_transcribe(model, trimmed, args.repeat)
+            report.update({
+                "model": args.model,
+                "transcribe_full_s": round(full_time, 3),
+                "transcribe_trimmed_s": round(trimmed_time, 3),
+                "seconds_saved": round(full_time - trimmed_time, 3),
+                "text_full": full_text,
+                "text_trimmed": trimmed_text,
+            })
+        print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
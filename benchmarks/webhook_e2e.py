@@ -0,0 +1,82 @@
+"""End-to-end check of the webhook mode against the fake Telegram Bot API.
+
+Usage: python -m benchmarks.webhook_e2e
+
+Boots the real Application from main.py behind the embedded webhook server,
+then checks readiness, secret-token validation and that a /start update
+posted to the webhook is answered. Prints a JSON report, exit status 1 on failure.
+"""
+import asyncio
+import json
+import os
+import socket
+import sys
+
+os.environ.setdefault("WHISPER_PRELOAD", "lazy")
+os.environ.setdefault("CHATGPT_API", "benchmark")
+
+import httpx
+
+import main
+from benchmarks.fake_telegram import FakeTelegram, text_update
+from bot.webhook import serve_webhook, SECRET_HEADER
+
+SECRET = "e2e-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run() -> dict:
+    fake = FakeTelegram()
+    await fake.start()
+    application = main.build_application("123456:e2e", fake.base_url, fake.base_file_url)
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/telegram"
+    stop = asyncio.Event()
+    server = asyncio.create_task(serve_webhook(application, url, "127.0.0.1", port, "/telegram",
+                                               SECRET, max_connections=10, stop=stop))
+    checks = {}
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as http:
+            for _ in range(100):
+                try:
+                    if (await http.get("/readyz")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.05)
+            checks["ready"] = (await http.get("/readyz")).status_code == 200
+            checks["healthy"] = (await http.get("/healthz")).status_code == 200
+
+            webhook = await fake.wait_for_call(lambda c: c["method"] == "setWebhook", timeout=5)
+            checks["set_webhook"] = (webhook["params"].get("secret_token") == SECRET
+                                     and int(webhook["params"].get("max_connections")) == 10)
+
+            update = {"update_id": 1, **text_update(42, "/start")}
+            wrong = await http.post("/telegram", json=update, headers={SECRET_HEADER: "wrong"})
+            checks["rejects_bad_secret"] = wrong.status_code == 403
+
+            mark = len(fake.calls)
+            ok = await http.post("/telegram", json=update, headers={SECRET_HEADER: SECRET})
+            reply = await fake.wait_for_call(lambda c: c["method"] == "sendMessage", after=mark, timeout=5)
+            checks["answers_update"] = ok.status_code == 200 and int(reply["params"]["chat_id"]) == 42
+    finally:
+        stop.set()
+        await server
+        await fake.stop()
+    return checks
+
+
+def main_() -> None:
+    checks = asyncio.run(run())
+    passed = all(checks.values())
+    print(json.dumps({"passed": passed, "checks": checks}))
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main_()
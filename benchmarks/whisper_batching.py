@@ -0,0 +1,51 @@
+"""Clips/second of batched whisper decoding against the batch size.
+
+Usage: python -m benchmarks.whisper_batching [--model tiny] [--sizes 1,2,4,8,16] [--repeat 3]
+
+The bundled data/*.ogg voice notes are decoded once and reused round-robin to
+fill each batch. Prints one JSON object per batch size.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+from bot.audio import decode_audio
+from bot.transcription import decode_batch
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "data")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--sizes", default="1,2,4,8,16")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    import whisper
+
+    model = whisper.load_model(args.model)
+    clips = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, "*.ogg"))):
+        with open(path, "rb") as f:
+            clips.append(decode_audio(f.read()))
+    decode_batch(model, clips[:1])  # warm-up
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        batch = [clips[i % len(clips)] for i in range(size)]
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            decode_batch(model, batch)
+        elapsed = time.perf_counter() - started
+        print(json.dumps({
+            "model": args.model,
+            "batch_size": size,
+            "seconds_per_batch": round(elapsed / args.repeat, 4),
+            "clips_per_second": round(size * args.repeat / elapsed, 3),
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Accuracy, speed and memory of the int8 whisper model against fp32 on the CPU.
+
+Usage: python -m benchmarks.whisper_quantization [--model tiny] [--repeat 3] [--threads N]
+                                                 [--reference transcripts.json]
+
+Each mode runs in a fresh interpreter so its memory is measured alone. For
+every data/*.ogg voice note the text, the best of --repeat transcription
+times and the real-time factor (transcription time / audio duration) are
+recorded. The word error rate of int8 is computed against the fp32 text, or
+against --reference (a {"file.ogg": "text"} JSON) for both modes when given.
+Prints one JSON report.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+PROBE = """
+import glob, json, os, resource, sys, time
+model_size, quantize, repeat, threads = sys.argv[1], sys.argv[2] == "int8", int(sys.argv[3]), int(sys.argv[4])
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+from bot.audio import SAMPLE_RATE, decode_audio
+from bot.whisper_models import WhisperModelRegistry
+registry = WhisperModelRegistry([model_size], model_size, "cpu", quantize=quantize, torch_threads=threads)
+import torch, whisper
+before = rss_mb()
+started = time.perf_counter()
+model = registry.load(model_size)
+load_seconds = time.perf_counter() - started
+loaded = rss_mb()
+
+files = {}
+for path in sorted(glob.glob(os.path.join("data", "*.ogg"))):
+    with open(path, "rb") as f:
+        audio = decode_audio(f.read())
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with registry.lease(model_size) as leased:
+            text = leased.transcribe(audio, fp16=False)["text"]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    files[os.path.basename(path)] = {"text": text.strip(), "seconds": best,
+                                     "audio_seconds": len(audio) / SAMPLE_RATE}
+print(json.dumps({
+    "load_seconds": load_seconds,
+    "model_rss_mb": loaded - before,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "torch_threads": torch.get_num_threads(),
+    "files": files,
+}))
+"""
+
+
+def words(text: str) -> list:
+    return re.findall(r"\w+", text.lower())
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word-level Levenshtein distance divided by the reference length."""
+    ref, hyp = words(reference), words(hypothesis)
+    if not ref:
+        return float(bool(hyp))
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        current = [i]
+        for j, h in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def probe(mode: str, args) -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE, args.model, mode, str(args.repeat),
+                          str(args.threads)], cwd=ROOT, check=True, capture_output=True,
+                         text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def summarize(run: dict, reference: dict) -> dict:
+    files = run["files"]
+    transcribe = sum(f["seconds"] for f in files.values())
+    audio = sum(f["audio_seconds"] for f in files.values())
+    summary = {
+        "load_seconds": round(run["load_seconds"], 3),
+        "model_rss_mb": round(run["model_rss_mb"], 1),
+        "peak_rss_mb": round(run["peak_rss_mb"], 1),
+        "torch_threads": run["torch_threads"],
+        "rtf": round(transcribe / audio, 4) if audio else None,
+        "files": {name: {"rtf": round(f["seconds"] / f["audio_seconds"], 4), "text": f["text"]}
+                  for name, f in files.items()},
+    }
+    if reference:
+        rates = [word_error_rate(reference[name], f["text"]) for name, f in files.items() if name in reference]
+        summary["wer"] = round(sum(rates) / len(rates), 4) if rates else None
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads, 0 uses all cpus")
+    parser.add_argument("--reference", help="JSON file mapping data file names to their true text")
+    args = parser.parse_args()
+
+    fp32, int8 = probe("fp32", args), probe("int8", args)
+    if args.reference:
+        with open(args.reference) as f:
+            reference = json.load(f)
+    else:
+        reference = {}
+    report = {"model": args.model, "reference": "file" if reference else "fp32",
+              "fp32": summarize(fp32, reference), "int8": summarize(int8, reference)}
+    if not reference:
+        # without true transcripts the int8 error is measured against the fp32 output
+        report["int8"]["wer"] = round(sum(
+            word_error_rate(fp32["files"][name]["text"], f["text"]) for name, f in int8["files"].items()
+        ) / max(1, len(int8["files"])), 4)
+    if report["fp32"]["rtf"] and report["int8"]["rtf"]:
+        report["speedup"] = round(report["fp32"]["rtf"] / report["int8"]["rtf"], 3)
+    report["memory_saved_mb"] = round(report["fp32"]["model_rss_mb"] - report["int8"]["model_rss_mb"], 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
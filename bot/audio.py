@@ -0,0 +1,52 @@
+import os
+import subprocess
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from config import AUDIO_SPILL_BYTES
+
+# whisper expects 16 kHz mono float32 samples in [-1, 1]
+SAMPLE_RATE = 16000
+
+
+class AudioDecodeError(RuntimeError):
+    """Raised when ffmpeg can not decode the received audio."""
+
+
+def decode_pcm16(data: bytes, sample_rate: int = SAMPLE_RATE,
+                 spill_threshold: Optional[int] = AUDIO_SPILL_BYTES) -> bytes:
+    """Decode any ffmpeg supported audio to raw 16-bit little-endian mono PCM."""
+    cmd = ["ffmpeg", "-loglevel", "error", "-threads", "0", "-i", "pipe:0",
+           "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-"]
+    if spill_threshold is None or len(data) <= spill_threshold:
+        return _run_ffmpeg(cmd, data)
+
+    # large inputs go through a private temp file so ffmpeg can seek in them
+    fd, path = tempfile.mkstemp(suffix=".audio")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        cmd[cmd.index("pipe:0")] = path
+        return _run_ffmpeg(cmd, None)
+    finally:
+        os.unlink(path)
+
+
+def pcm16_to_float32(pcm: bytes) -> np.ndarray:
+    return np.frombuffer(pcm, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+def decode_audio(data: bytes, sample_rate: int = SAMPLE_RATE,
+                 spill_threshold: Optional[int] = AUDIO_SPILL_BYTES) -> np.ndarray:
+    """Decode audio bytes straight to the float32 buffer `model.transcribe` accepts."""
+    return pcm16_to_float32(decode_pcm16(data, sample_rate, spill_threshold))
+
+
+def _run_ffmpeg(cmd: list, stdin: Optional[bytes]) -> bytes:
+    try:
+        out = subprocess.run(cmd, input=stdin, capture_output=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise AudioDecodeError(f"Failed to decode audio: {e.stderr.decode(errors='replace')}") from e
+    return out.stdout
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import re
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import LONG_AUDIO_SECONDS, LONG_AUDIO_CHUNK_SECONDS, LONG_AUDIO_OVERLAP
+from bot.audio import SAMPLE_RATE
+from bot.model_policy import DecodingProfile
+from bot.transcription import TranscriptionService, transcription_service
+from bot.vad import FRAME, frame_energy_db
+
+logger = logging.getLogger(__name__)
+
+# a chunk boundary is placed at the quietest frame of this many last seconds of the chunk
+SEARCH_SECONDS = 5.0
+# words compared when removing the text transcribed twice in the overlap
+MAX_OVERLAP_WORDS = 16
+
+_WORD = re.compile(r"\w+")
+
+
+def split_at_silences(audio: np.ndarray, chunk_seconds: float = 30.0,
+                      overlap: float = 1.0) -> List[Tuple[int, int]]:
+    """Sample ranges of at most `chunk_seconds`, cut in the quietest spot near the end.
+
+    Each chunk starts `overlap` seconds before the previous one ended, so a word
+    cut at the boundary is complete in at least one of them.
+    """
+    length = int(chunk_seconds * SAMPLE_RATE)
+    if len(audio) <= length:
+        return [(0, len(audio))]
+    energy = frame_energy_db(audio)
+    back = int(overlap * SAMPLE_RATE)
+    chunks = []
+    start = 0
+    while start + length < len(audio):
+        last = (start + length) // FRAME
+        first = max((start + back) // FRAME + 1, last - int(SEARCH_SECONDS * SAMPLE_RATE / FRAME))
+        cut = (first + int(np.argmin(energy[first:last]))) * FRAME + FRAME // 2
+        chunks.append((start, cut))
+        start = cut - back
+    chunks.append((start, len(audio)))
+    return chunks
+
+
+def _normalize(word: str) -> str:
+    return "".join(_WORD.findall(word.lower()))
+
+
+def stitch(left: str, right: str, max_words: int = MAX_OVERLAP_WORDS) -> str:
+    """Join two consecutive transcripts, dropping the words both heard in the overlap."""
+    left_words, right_words = left.split(), right.split()
+    if not left_words:
+        return right.strip()
+    tail = [_normalize(w) for w in left_words[-max_words:]]
+    head = [_normalize(w) for w in right_words[:max_words]]
+    # the longest run of words ending the left text that also starts the right one
+    for size in range(min(len(tail), len(head)), 0, -1):
+        if tail[-size:] == head[:size] and any(tail[-size:]):
+            right_words = right_words[size:]
+            break
+    return " ".join(left_words + right_words)
+
+
+class LongAudioTranscriber:
+    """Transcribes long voice notes as overlapping chunks on several workers at once.
+
+    At most `concurrency` chunks are in the transcription queue at a time, so a
+    long note does not fill the queue other users' notes wait in. `on_partial`
+    receives the text stitched so far each time the next chunk in order is done.
+    """
+
+    def __init__(self, service: TranscriptionService, threshold: float = 60.0,
+                 chunk_seconds: float = 30.0, overlap: float = 1.0,
+                 concurrency: Optional[int] = None):
+        self.service = service
+        self.threshold = threshold
+        self.chunk_seconds = chunk_seconds
+        self.overlap = overlap
+        self.concurrency = concurrency
+        self.clips = 0
+        self.chunks = 0
+
+    def is_long(self, audio: np.ndarray) -> bool:
+        return self.threshold > 0 and len(audio) > self.threshold * SAMPLE_RATE
+
+    async def transcribe(self, audio: np.ndarray, size: Optional[str] = None,
+                         profile: Optional[DecodingProfile] = None,
+                         on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        chunks = split_at_silences(audio, self.chunk_seconds, self.overlap)
+        self.clips += 1
+        self.chunks += len(chunks)
+        logger.info("Transcribing %.0f s of audio as %d chunks", len(audio) / SAMPLE_RATE, len(chunks))
+        slots = asyncio.Semaphore(self.concurrency or self.service.workers)
+        options = profile.transcribe_options() if profile is not None else {}
+        # chunks are independent, the previous chunk's text is not there to condition on
+        options["condition_on_previous_text"] = False
+
+        async def run(start: int, end: int) -> str:
+            async with slots:
+                result = await self.service.transcribe(audio[start:end], size, **options)
+            return result["text"]
+
+        tasks = [asyncio.ensure_future(run(start, end)) for start, end in chunks]
+        index = {task: i for i, task in enumerate(tasks)}
+        texts: List[Optional[str]] = [None] * len(tasks)
+        stitched, in_order = "", 0
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    texts[index[task]] = task.result()
+                # partial text only grows from the start, a later chunk waits for the earlier ones
+                progressed = False
+                while in_order < len(texts) and texts[in_order] is not None:
+                    stitched = stitch(stitched, texts[in_order])
+                    in_order += 1
+                    progressed = True
+                if progressed and pending and on_partial is not None:
+                    await on_partial(stitched)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return stitched
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "clips": self.clips,
+            "chunks": self.chunks,
+            "avg_chunks": self.chunks / self.clips if self.clips else 0.0,
+        }
+
+
+long_audio_transcriber = LongAudioTranscriber(transcription_service, LONG_AUDIO_SECONDS,
+                                              LONG_AUDIO_CHUNK_SECONDS, LONG_AUDIO_OVERLAP)
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import OPENAI_MODEL, MEMORY_TURNS, MEMORY_RECENT_TOKENS, MEMORY_SUMMARY_TOKENS
+from bot.tokens import context_window, count_message_tokens, count_text_tokens
+from bot.utilities import chat, is_error
+
+logger = logging.getLogger(__name__)
+
+# chat_data key of a chat's memory: {"summary": str, "turns": [...], "pending": [...]}
+MEMORY = "memory"
+
+SUMMARY_MESSAGE = "Summary of the conversation so far:\n{summary}"
+REFRESH_PROMPT = ("Update the summary of a conversation between a user and an assistant with "
+                  "its next exchanges. Keep the facts, names, numbers and open questions the "
+                  "user may come back to, drop small talk. Answer with the new summary only.\n\n"
+                  "Current summary:\n{summary}\n\nNext exchanges:\n{exchanges}")
+
+
+def clip(text: str, tokens: int, model: str = OPENAI_MODEL) -> str:
+    """`text` cut between words to at most about `tokens` tokens."""
+    if count_text_tokens(text, model) <= tokens:
+        return text
+    words = text.split()
+    # token counts grow with the words, halve the search space instead of counting each prefix
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_text_tokens(" ".join(words[:middle]), model) <= tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low]) + " …"
+
+
+class ConversationMemory:
+    """Per-chat history for `chat`, with a prompt size that does not grow with the chat.
+
+    The last `turns` exchanges, and no more than `recent_tokens` tokens of
+    them, are sent verbatim. Older exchanges are folded into a rolling summary
+    of at most `summary_tokens` tokens by a background call started after the
+    answer was sent, so the user never waits for it. Exchanges waiting to be
+    folded are still sent verbatim, nothing is forgotten while a refresh runs.
+    A refresh prompt never exceeds the context window less the summary's
+    tokens, a backlog too big for one is folded over several calls. The memory
+    lives in chat_data, so it is persisted with it.
+    """
+
+    def __init__(self, turns: int = 6, recent_tokens: int = 1500, summary_tokens: int = 300,
+                 model: str = OPENAI_MODEL):
+        self.turns = turns
+        self.recent_tokens = recent_tokens
+        self.summary_tokens = summary_tokens
+        self.model = model
+        # chat id -> running refresh
+        self._refreshing: Dict[int, asyncio.Task] = {}
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.folded_turns = 0
+        self.dropped_turns = 0
+
+    @staticmethod
+    def _memory(chat_data: Dict[Any, Any]) -> Dict[str, Any]:
+        return chat_data.setdefault(MEMORY, {"summary": "", "turns": [], "pending": []})
+
+    def messages(self, chat_data: Dict[Any, Any], text: str) -> List[Dict[str, str]]:
+        """The prompt for the user's next message `text`: summary, recent turns, then `text`."""
+        memory = self._memory(chat_data)
+        messages = []
+        if memory["summary"]:
+            messages.append({"role": "system", "content": SUMMARY_MESSAGE.format(summary=memory["summary"])})
+        for turn in memory["pending"] + memory["turns"]:
+            messages += turn
+        messages.append({"role": "user", "content": text})
+        return messages
+
+    def record(self, chat_id: int, chat_data: Dict[Any, Any], text: str, answer: str,
+               client: Any = None, user_id: Optional[int] = None, application: Any = None) -> None:
+        """Remember an exchange, and start folding the ones that fell out of the window.
+
+        With the `application`, chat_data is marked for persistence after each
+        fold, as the refresh ends after the handler that started it.
+        """
+        memory = self._memory(chat_data)
+        memory["turns"].append([
+            {"role": "user", "content": clip(text, self.recent_tokens // 2, self.model)},
+            {"role": "assistant", "content": clip(answer, self.recent_tokens // 2, self.model)},
+        ])
+        turns = memory["turns"]
+        while len(turns) > 1 and (len(turns) > self.turns or
+                                  count_message_tokens(sum(turns, []), self.model) > self.recent_tokens):
+            memory["pending"].append(turns.pop(0))
+        if len(memory["pending"]) > self.turns:
+            # the refreshes keep failing, do not let the prompt grow with the backlog
+            dropped = len(memory["pending"]) - self.turns
+            del memory["pending"][:dropped]
+            self.dropped_turns += dropped
+        if memory["pending"] and client is not None and chat_id not in self._refreshing:
+            task = asyncio.ensure_future(self._refresh(memory, client, user_id, chat_id, application))
+            self._refreshing[chat_id] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(chat_id, None))
+
+    def _refresh_prompt(self, memory: Dict[str, Any]) -> Tuple[List[list], str]:
+        """The oldest pending turns that fit in one refresh prompt, and that prompt."""
+        budget = context_window(self.model) - self.summary_tokens
+
+        def prompt_for(exchanges: str) -> str:
+            return REFRESH_PROMPT.format(summary=memory["summary"] or "(none yet)", exchanges=exchanges)
+
+        def tokens(prompt: str) -> int:
+            return count_message_tokens([{"role": "user", "content": prompt}], self.model)
+
+        lines: List[str] = []
+        folding: List[list] = []
+        for turn in memory["pending"]:
+            turn_lines = [f"{message['role']}: {message['content']}" for message in turn]
+            if tokens(prompt_for("\n".join(lines + turn_lines))) > budget:
+                break
+            lines += turn_lines
+            folding.append(turn)
+        if not folding:
+            # a single exchange too long for the window, fold what fits of it
+            folding = memory["pending"][:1]
+            room = budget - tokens(prompt_for(""))
+            lines = [clip("\n".join(f"{message['role']}: {message['content']}" for message in folding[0]),
+                          max(0, room - 1), self.model)]
+        return folding, prompt_for("\n".join(lines))
+
+    async def _refresh(self, memory: Dict[str, Any], client: Any, user_id: Optional[int],
+                       chat_id: Optional[int] = None, application: Any = None) -> None:
+        # exchanges recorded while a refresh runs are folded by the next round
+        while memory["pending"]:
+            folding, prompt = self._refresh_prompt(memory)
+            self.refreshes += 1
+            summary = await chat(MSGS=[{"role": "user", "content": prompt}],
+                                 MaxToken=self.summary_tokens, client=client, user_id=user_id)
+            if is_error(summary):
+                # the turns stay pending and verbatim, the next exchange tries again
+                self.refresh_failures += 1
+                logger.warning("Could not refresh the conversation summary: %s", summary)
+                return
+            memory["summary"] = summary.strip()
+            # the backlog may have been trimmed meanwhile, only drop what is still there
+            del memory["pending"][:sum(1 for turn in folding if turn in memory["pending"])]
+            self.folded_turns += len(folding)
+            if application is not None:
+                # no update follows the fold, flush it with the next persistence run
+                application.mark_data_for_update_persistence(chat_ids=chat_id)
+
+    async def wait(self) -> None:
+        """Wait until no refresh is running."""
+        while self._refreshing:
+            await asyncio.gather(*self._refreshing.values(), return_exceptions=True)
+
+    def close(self) -> None:
+        """Cancel the running refreshes, their turns stay pending in chat_data."""
+        for task in list(self._refreshing.values()):
+            task.cancel()
+
+    @staticmethod
+    def forget(chat_data: Dict[Any, Any]) -> None:
+        chat_data.pop(MEMORY, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "refreshing": len(self._refreshing),
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "folded_turns": self.folded_turns,
+            "dropped_turns": self.dropped_turns,
+        }
+
+
+conversation_memory = ConversationMemory(MEMORY_TURNS, MEMORY_RECENT_TOKENS, MEMORY_SUMMARY_TOKENS)
@@ -0,0 +1,10 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from bot.memory import conversation_memory
+
+
+async def forget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/forget clears what the bot remembers of this chat."""
+    conversation_memory.forget(context.chat_data)
+    await update.message.reply_text("Done, the next message starts a new conversation.")
@@ -0,0 +1,191 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+logger = logging.getLogger(__name__)
+
+# seconds, from a cached transcription to a long voice note on a busy cpu
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# recent samples kept per series for the percentiles shown by /stats
+WINDOW = 1024
+
+# name of the handler currently processing the update, set by `handler`
+current_handler: contextvars.ContextVar[str] = contextvars.ContextVar("current_handler", default="")
+
+Labels = Tuple[str, str, str]  # stage, handler, model
+
+
+class _Series:
+    __slots__ = ("buckets", "count", "sum", "errors", "recent")
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.recent: Deque[float] = deque(maxlen=WINDOW)
+
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+class StageMetrics:
+    """Timing histograms and counters of the hot path stages, by handler and model.
+
+    Rendered in the Prometheus text format by `render`; components with a
+    `stats()` method can be added with `register` and are exported as gauges.
+    """
+
+    def __init__(self):
+        self._series: Dict[Labels, _Series] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        # name -> sorted label pairs -> count
+        self._counters: Dict[str, Dict[Tuple[Tuple[str, str], ...], int]] = {}
+        # stages also run on the transcription threads
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, model: str = "", handler: Optional[str] = None,
+                error: bool = False) -> None:
+        labels = (stage, current_handler.get() if handler is None else handler, model)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = _Series()
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series.buckets[i] += 1
+                    break
+            series.count += 1
+            series.sum += seconds
+            series.errors += error
+            series.recent.append(seconds)
+
+    @contextmanager
+    def time(self, stage: str, model: str = "", handler: Optional[str] = None) -> Iterator[None]:
+        """Time the block as `stage`, failures are counted in bot_stage_errors_total."""
+        # the handler is read up front, the block may run on another thread
+        handler = current_handler.get() if handler is None else handler
+        started = time.perf_counter()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            self.observe(stage, time.perf_counter() - started, model, handler, error)
+
+    def increment(self, name: str, **labels: str) -> None:
+        """Count one `name` event, exported as the bot_<name>_total counter."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._counters.setdefault(name, {})
+            counts[key] = counts.get(key, 0) + 1
+
+    def register(self, component: str, stats: Callable[[], Dict[str, Any]]) -> None:
+        self._collectors[component] = stats
+
+    def percentiles(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = [(labels, list(series.recent), series.count, series.errors)
+                     for labels, series in sorted(self._series.items())]
+        return [{
+            "stage": stage, "handler": handler, "model": model, "count": count, "errors": errors,
+            "p50": percentile(recent, 0.50), "p95": percentile(recent, 0.95),
+            "p99": percentile(recent, 0.99),
+        } for (stage, handler, model), recent, count, errors in items if recent]
+
+    def render(self) -> str:
+        lines = [
+            "# HELP bot_stage_seconds Time spent in each stage of an update.",
+            "# TYPE bot_stage_seconds histogram",
+        ]
+        errors = [
+            "# HELP bot_stage_errors_total Stage runs that raised.",
+            "# TYPE bot_stage_errors_total counter",
+        ]
+        with self._lock:
+            for (stage, handler, model), series in sorted(self._series.items()):
+                labels = f'stage="{stage}",handler="{handler}",model="{model}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, series.buckets):
+                    cumulative += count
+                    lines.append(f'bot_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'bot_stage_seconds_bucket{{{labels},le="+Inf"}} {series.count}')
+                lines.append(f"bot_stage_seconds_sum{{{labels}}} {series.sum:.6f}")
+                lines.append(f"bot_stage_seconds_count{{{labels}}} {series.count}")
+                errors.append(f"bot_stage_errors_total{{{labels}}} {series.errors}")
+            lines += errors
+            for name, counts in sorted(self._counters.items()):
+                lines.append(f"# TYPE bot_{name}_total counter")
+                for key, count in sorted(counts.items()):
+                    labels = ",".join(f'{label}="{value}"' for label, value in key)
+                    lines.append(f"bot_{name}_total{{{labels}}} {count}")
+        for component, stats in self._collectors.items():
+            try:
+                values = stats()
+            except Exception:
+                logger.exception("Could not collect the %s stats", component)
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"bot_{component}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def handler(name: str):
+    """Label the stages timed while the decorated handler runs, and time the handler itself."""
+    def decorate(callback):
+        @functools.wraps(callback)
+        async def wrapper(*args, **kwargs):
+            token = current_handler.set(name)
+            try:
+                with stage_metrics.time("handler"):
+                    return await callback(*args, **kwargs)
+            finally:
+                current_handler.reset(token)
+        return wrapper
+    return decorate
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, metrics: StageMetrics) -> None:
+        self.metrics = metrics
+
+    def get(self) -> None:
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(self.metrics.render())
+
+
+def start_metrics_server(port: int, listen: str = "0.0.0.0") -> HTTPServer:
+    """Serve /metrics on its own port, for polling mode where there is no webhook server."""
+    server = HTTPServer(tornado.web.Application([
+        ("/metrics", MetricsHandler, {"metrics": stage_metrics}),
+    ]))
+    server.listen(port, address=listen)
+    logger.info("Metrics served on %s:%d/metrics", listen, port)
+    return server
+
+
+def format_stats(rows: List[Dict[str, Any]]) -> str:
+    """The percentiles as a short monospace table for the /stats command."""
+    if not rows:
+        return "No requests measured yet."
+    lines = [f"{'stage':<18}{'handler':<28}{'model':<14}{'n':>6}{'p50':>8}{'p95':>8}{'p99':>8}"]
+    for row in rows:
+        lines.append(
+            f"{row['stage'][:17]:<18}{row['handler'][:27]:<28}{row['model'][:13]:<14}{row['count']:>6}"
+            + "".join(f"{row[p] * 1000:>6.0f}ms" for p in ("p50", "p95", "p99"))
+        )
+    return "\n".join(lines)
+
+
+stage_metrics = StageMetrics()
@@ -0,0 +1,128 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from config import (
+    WHISPER_POLICY,
+    WHISPER_BUSY_QUEUE,
+    WHISPER_IDLE_MAX_SECONDS,
+    WHISPER_LANGUAGE,
+)
+from bot.metrics import stage_metrics
+from bot.transcription import TranscriptionService, transcription_service
+from bot.whisper_models import WhisperModelRegistry, whisper_registry
+
+# smallest to largest, sizes outside this list are ranked after it
+MODEL_ORDER = ("tiny", "base", "small", "medium", "large")
+
+# user_data keys of the /quality command
+QUALITY, LANGUAGE = "whisper_quality", "whisper_language"
+QUALITY_LEVELS = ("fast", "auto", "best")
+
+
+def language_code(language: str) -> Optional[str]:
+    """Whisper's code of a language given by code ("fr") or name ("french"), None if unknown."""
+    from whisper.tokenizer import LANGUAGES, TO_LANGUAGE_CODE
+
+    language = language.lower()
+    return language if language in LANGUAGES else TO_LANGUAGE_CODE.get(language)
+
+
+class DecodingProfile(NamedTuple):
+    """How whisper decodes a clip. Hashable, clips with the same profile can share a batch."""
+
+    name: str
+    # None decodes greedily
+    beam_size: Optional[int]
+    # retry at higher temperatures when the output looks like a hallucination
+    fallback: bool
+    language: Optional[str] = None
+
+    def transcribe_options(self) -> Dict[str, Any]:
+        options: Dict[str, Any] = {"beam_size": self.beam_size, "language": self.language}
+        if not self.fallback:
+            options["temperature"] = 0.0
+            options["condition_on_previous_text"] = False
+        return options
+
+    def decode_options(self) -> Dict[str, Any]:
+        # batched decoding has no temperature fallback in any profile
+        return {"beam_size": self.beam_size, "language": self.language}
+
+
+FAST = DecodingProfile("fast", beam_size=None, fallback=False)
+BALANCED = DecodingProfile("balanced", beam_size=None, fallback=True)
+QUALITY_PROFILE = DecodingProfile("quality", beam_size=5, fallback=True)
+
+
+class Decision(NamedTuple):
+    size: str
+    profile: DecodingProfile
+    reason: str
+
+
+class TranscriptionPolicy:
+    """Picks the whisper model and decoding profile of each voice message.
+
+    Busy (at least `busy_queue` waiting jobs per worker) or asked for by the
+    user: the smallest loaded model, greedy decoding without fallback. Idle (no
+    waiting job and a free worker) and a clip no longer than `idle_max_seconds`,
+    or a user asking for the best quality while the node is not busy: the
+    largest loaded model with beam search. Otherwise the default model with
+    whisper's greedy decoding and fallback. Only the sizes the registry was
+    configured with are used, so a decision never triggers a model load.
+    """
+
+    def __init__(self, registry: WhisperModelRegistry, service: TranscriptionService, adaptive: bool = True, busy_queue: float = 1.0,
+                 idle_max_seconds: float = 30.0, language: Optional[str] = None):
+        self.registry = registry
+        self.service = service
+        self.adaptive = adaptive
+        self.busy_queue = busy_queue
+        self.idle_max_seconds = idle_max_seconds
+        self.language = language
+        self.decisions: Dict[Tuple[str, str, str], int] = {}
+
+    def sizes(self) -> List[str]:
+        rank = {size: i for i, size in enumerate(MODEL_ORDER)}
+        return sorted(self.registry.sizes, key=lambda size: rank.get(size.split(".")[0], len(rank)))
+
+    def decide(self, duration: float, user_data: Optional[Dict[Any, Any]] = None) -> Decision:
+        """The decision for a clip; `record` it once the clip is actually transcribed."""
+        user_data = user_data or {}
+        preference = user_data.get(QUALITY, "auto")
+        language = user_data.get(LANGUAGE) or self.language
+        if not self.adaptive:
+            decision = Decision(self.registry.default, BALANCED, "fixed")
+        else:
+            sizes = self.sizes()
+            workers = self.service.workers
+            busy = self.service.queue_depth >= self.busy_queue * workers
+            idle = self.service.queue_depth == 0 and self.service.running < workers
+            if busy:
+                decision = Decision(sizes[0], FAST, "busy")
+            elif preference == "fast":
+                decision = Decision(sizes[0], FAST, "preference")
+            elif preference == "best":
+                decision = Decision(sizes[-1], QUALITY_PROFILE, "preference")
+            elif idle and duration <= self.idle_max_seconds:
+                decision = Decision(sizes[-1], QUALITY_PROFILE, "idle")
+            else:
+                decision = Decision(self.registry.default, BALANCED, "normal")
+        return decision._replace(profile=decision.profile._replace(language=language))
+
+    def record(self, decision: Decision) -> None:
+        key = (decision.size, decision.profile.name, decision.reason)
+        self.decisions[key] = self.decisions.get(key, 0) + 1
+        stage_metrics.increment("whisper_decisions", model=decision.size,
+                                profile=decision.profile.name, reason=decision.reason)
+
+    def stats(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for (_, profile, reason), count in self.decisions.items():
+            counts[f"profile_{profile}"] = counts.get(f"profile_{profile}", 0) + count
+            counts[f"reason_{reason}"] = counts.get(f"reason_{reason}", 0) + count
+        return counts
+
+
+transcription_policy = TranscriptionPolicy(whisper_registry, transcription_service,
+                                           WHISPER_POLICY == "adaptive", WHISPER_BUSY_QUEUE,
+                                           WHISPER_IDLE_MAX_SECONDS, WHISPER_LANGUAGE)
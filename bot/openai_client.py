@@ -0,0 +1,79 @@
+import logging
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE,
+    OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_HTTP2,
+    OPENAI_TIMEOUT,
+    OPENAI_CONNECT_TIMEOUT,
+)
+from bot.utilities import getOpenAiClient
+
+logger = logging.getLogger(__name__)
+
+# bot_data key the handlers read the shared client from
+OPENAI_CLIENT = "openai_client"
+
+
+class OpenAIClientProvider:
+    """Owns the single AsyncOpenAI client of the process and its HTTP connection pool."""
+
+    def __init__(self, api_key: Optional[str], base_url: Optional[str] = None,
+                 max_connections: int = 100, max_keepalive: int = 20,
+                 keepalive_expiry: float = 60.0, http2: bool = False,
+                 timeout: float = 60.0, connect_timeout: float = 5.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.http2 = http2
+        self._client: Optional[AsyncOpenAI] = None
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            raise RuntimeError("OpenAI client used before the application was initialized")
+        return self._client
+
+    def start(self) -> AsyncOpenAI:
+        if self._client is None:
+            # retries are done by bot.resilience, which also honours the overall deadline
+            self._client = getOpenAiClient(self.api_key, http_client=self._http_client(),
+                                           base_url=self.base_url, max_retries=0)
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def _http_client(self) -> httpx.AsyncClient:
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("OPENAI_HTTP2 is set but the h2 package is missing, using HTTP/1.1")
+                http2 = False
+        return httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=http2)
+
+
+openai_provider = OpenAIClientProvider(
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE,
+    OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_HTTP2,
+    OPENAI_TIMEOUT,
+    OPENAI_CONNECT_TIMEOUT,
+)
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+from telegram.ext._utils.types import CDCData, ConversationDict, ConversationKey
+
+logger = logging.getLogger(__name__)
+
+# values bigger than this are zlib compressed, transcripts compress about 3x
+COMPRESS_ABOVE = 1024
+_RAW, _ZLIB = b"p", b"z"
+
+# table -> key column
+_TABLES = {"user_data": "user_id", "chat_data": "chat_id"}
+
+
+def dumps(value: Any) -> bytes:
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) > COMPRESS_ABOVE:
+        return _ZLIB + zlib.compress(data, 1)
+    return _RAW + data
+
+
+def loads(blob: bytes) -> Any:
+    if blob[:1] == _ZLIB:
+        return pickle.loads(zlib.decompress(blob[1:]))
+    return pickle.loads(blob[1:])
+
+
+class SQLitePersistence(BasePersistence):
+    """Stores user_data, chat_data and conversation states in a sqlite file (WAL mode).
+
+    Only entries the Application reports as changed are written, as one
+    transaction per update_interval with a per-key upsert each. user_data and
+    chat_data are loaded lazily: a user's row is read the first time one of
+    their updates is processed, not at startup. bot_data and callback_data are
+    not stored, bot_data holds process resources like the OpenAI client.
+    """
+
+    def __init__(self, path: str, update_interval: float = 5.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True,
+                                        callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for table, column in _TABLES.items():
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ({column} INTEGER PRIMARY KEY, data BLOB NOT NULL)"
+            )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversations "
+            "(name TEXT NOT NULL, key TEXT NOT NULL, state BLOB NOT NULL, PRIMARY KEY (name, key))"
+        )
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        self._write_lock = asyncio.Lock()
+        # table -> {key: value or None to delete}, written by the next flush
+        self._dirty: Dict[str, Dict[Any, Any]] = {"user_data": {}, "chat_data": {}, "conversations": {}}
+        self._loaded: Dict[str, set] = {"user_data": set(), "chat_data": set()}
+        self._write_task: Optional[asyncio.Task] = None
+        self.writes = 0
+        self.rows_written = 0
+
+    # loading -------------------------------------------------------------
+
+    async def get_user_data(self) -> Dict[int, Any]:
+        # filled in per user by refresh_user_data
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_bot_data(self) -> Any:
+        return {}
+
+    async def get_callback_data(self) -> Optional[CDCData]:
+        return None
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        rows = await asyncio.to_thread(
+            self._query, "SELECT key, state FROM conversations WHERE name = ?", (name,)
+        )
+        return {tuple(json.loads(key)): loads(state) for key, state in rows}
+
+    async def refresh_user_data(self, user_id: int, user_data: Any) -> None:
+        await self._load_into("user_data", user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        await self._load_into("chat_data", chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass
+
+    async def _load_into(self, table: str, key: int, target: Any) -> None:
+        if key in self._loaded[table]:
+            return
+        self._loaded[table].add(key)
+        rows = await asyncio.to_thread(
+            self._query, f"SELECT data FROM {table} WHERE {_TABLES[table]} = ?", (key,)
+        )
+        if rows:
+            stored = loads(rows[0][0])
+            # whatever this update already wrote wins over the stored copy
+            for name, value in stored.items():
+                target.setdefault(name, value)
+
+    # writing -------------------------------------------------------------
+
+    async def update_user_data(self, user_id: int, data: Any) -> None:
+        self._mark("user_data", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        self._mark("chat_data", chat_id, data)
+
+    async def update_conversation(self, name: str, key: ConversationKey,
+                                  new_state: Optional[object]) -> None:
+        self._mark("conversations", (name, json.dumps(list(key))), new_state)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded["user_data"].add(user_id)
+        self._mark("user_data", user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._loaded["chat_data"].add(chat_id)
+        self._mark("chat_data", chat_id, None)
+
+    async def update_bot_data(self, data: Any) -> None:
+        pass
+
+    async def update_callback_data(self, data: CDCData) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._write_task is not None:
+            # a failure there is logged and its entries are back in _dirty, written below
+            await asyncio.gather(self._write_task, return_exceptions=True)
+        await self._write()
+
+    def _mark(self, table: str, key: Any, value: Any) -> None:
+        self._dirty[table][key] = value
+        if self._write_task is None or self._write_task.done():
+            # Application.update_persistence gathers all update_* calls of one run;
+            # they complete before this task starts, so the whole run is one transaction
+            self._write_task = asyncio.ensure_future(self._background_write())
+
+    async def _background_write(self) -> None:
+        try:
+            # changes made while a batch was being written go in the next one
+            while any(self._dirty.values()):
+                await self._write()
+        except Exception:
+            # already logged, the next change or flush() writes the entries again
+            pass
+
+    async def _write(self) -> None:
+        async with self._write_lock:
+            dirty = self._dirty
+            if not any(dirty.values()):
+                return
+            self._dirty = {table: {} for table in dirty}
+            try:
+                await asyncio.to_thread(self._write_batch, dirty)
+            except Exception:
+                logger.exception("Could not write %d persistence entries, keeping them for the next write",
+                                 sum(len(entries) for entries in dirty.values()))
+                # entries changed again meanwhile keep their newer value
+                for table, entries in dirty.items():
+                    self._dirty[table] = {**entries, **self._dirty[table]}
+                raise
+
+    def _write_batch(self, dirty: Dict[str, Dict[Any, Any]]) -> None:
+        with self._db_lock, self._db:
+            for table, column in _TABLES.items():
+                upserts = [(key, dumps(value)) for key, value in dirty[table].items() if value is not None]
+                deletes = [(key,) for key, value in dirty[table].items() if value is None]
+                self._db.executemany(
+                    f"INSERT INTO {table} ({column}, data) VALUES (?, ?) "
+                    f"ON CONFLICT({column}) DO UPDATE SET data = excluded.data", upserts
+                )
+                self._db.executemany(f"DELETE FROM {table} WHERE {column} = ?", deletes)
+            conversations = dirty["conversations"]
+            self._db.executemany(
+                "INSERT INTO conversations (name, key, state) VALUES (?, ?, ?) "
+                "ON CONFLICT(name, key) DO UPDATE SET state = excluded.state",
+                [(name, key, dumps(state)) for (name, key), state in conversations.items()
+                 if state is not None],
+            )
+            self._db.executemany(
+                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                [(name, key) for (name, key), state in conversations.items() if state is None],
+            )
+        self.writes += 1
+        self.rows_written += sum(len(entries) for entries in dirty.values())
+
+    def _query(self, sql: str, params: Tuple) -> List[Tuple]:
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def close(self) -> None:
+        with self._db_lock:
+            self._db.close()
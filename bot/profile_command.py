@@ -0,0 +1,27 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config import ADMIN_USER_IDS
+from bot.profiling import profiler
+
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin only: /profile on, /profile off, or /profile for the current status."""
+    if update.effective_user is None or update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    action = context.args[0].lower() if context.args else ""
+    if action == "on":
+        profiler.start()
+        text = f"Profiling enabled, profiles are written to {profiler.directory}."
+    elif action == "off":
+        path = profiler.stop()
+        text = f"Profiling disabled, last profile: {path}." if path else "Profiling disabled."
+    else:
+        stats = profiler.stats()
+        text = (f"Profiling is {'on' if profiler.enabled else 'off'}.\n"
+                f"Samples pending: {stats['samples']}, profiles written: {stats['dumps']}, "
+                f"event loop stalls: {stats['stalls']}.")
+        if profiler.recent_stalls:
+            stall = profiler.recent_stalls[-1]
+            text += f"\nLast stall: {stall['blocked'] * 1000:.0f} ms in {stall['handler'] or 'an unwrapped callback'}."
+    await update.message.reply_text(text)
@@ -0,0 +1,216 @@
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Iterable, Optional
+
+from telegram.ext import Application, ConversationHandler
+
+from config import (
+    PROFILING,
+    PROFILE_DIR,
+    PROFILE_INTERVAL,
+    PROFILE_DUMP_INTERVAL,
+    PROFILE_BLOCK_THRESHOLD,
+)
+
+logger = logging.getLogger(__name__)
+
+# deepest stack kept per sample, handlers rarely go past 60 frames
+MAX_DEPTH = 128
+
+
+def collapse(frame: Any) -> str:
+    """The stack of `frame` in the collapsed format of flamegraph.pl and speedscope."""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """Opt-in sampling profiler and event-loop stall detector.
+
+    While enabled, a thread samples the event loop thread every `interval`
+    seconds and keeps the stacks of samples taken while a wrapped callback
+    runs, rooted at the callback's name. Every `dump_interval` seconds they are
+    written to `directory` as collapsed stacks. A second thread raises a warning
+    with the loop's current stack whenever the loop has not run a heartbeat for
+    `block_threshold` seconds. When disabled the wrappers cost one attribute check.
+    """
+
+    def __init__(self, directory: str, interval: float = 0.01, dump_interval: float = 60.0,
+                 block_threshold: float = 0.1):
+        self.directory = directory
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self.block_threshold = block_threshold
+        self.enabled = False
+        self.samples: Counter = Counter()
+        self.stalls = 0
+        self.recent_stalls: Deque[Dict[str, Any]] = deque(maxlen=20)
+        self.dumps = 0
+        # running task -> name of the outermost wrapped callback it is in
+        self._tasks: Dict[asyncio.Task, str] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._last_beat = 0.0
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    # switching ---------------------------------------------------------------
+
+    def start(self) -> None:
+        """Enable profiling, must be called from the event loop thread."""
+        if self.enabled:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._last_beat = time.monotonic()
+        self._loop.call_soon(self._beat)
+        self._threads = [
+            threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True),
+            threading.Thread(target=self._watch_loop, name="profiler-watchdog", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        self.enabled = True
+        logger.info("Profiling enabled: sampling every %.0f ms, stalls over %.0f ms reported, "
+                    "profiles written to %s", self.interval * 1000, self.block_threshold * 1000,
+                    self.directory)
+
+    def stop(self) -> Optional[str]:
+        """Disable profiling and write what was sampled since the last dump."""
+        if not self.enabled:
+            return None
+        self.enabled = False
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._tasks.clear()
+        logger.info("Profiling disabled")
+        return self.dump()
+
+    # wrapping ----------------------------------------------------------------
+
+    def wrap(self, name: str):
+        """Decorator attributing the samples taken while the coroutine runs to `name`."""
+        def decorate(callback):
+            if getattr(callback, "__profiled__", False):
+                return callback
+
+            @functools.wraps(callback)
+            async def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return await callback(*args, **kwargs)
+                task = asyncio.current_task()
+                outermost = task not in self._tasks
+                if outermost:
+                    self._tasks[task] = name
+                try:
+                    return await callback(*args, **kwargs)
+                finally:
+                    if outermost:
+                        self._tasks.pop(task, None)
+            wrapper.__profiled__ = True
+            return wrapper
+        return decorate
+
+    def wrap_handlers(self, application: Application) -> None:
+        """Wrap the callback of every handler of `application`, nested conversations included."""
+        for group, handlers in application.handlers.items():
+            if group >= 0:
+                self._wrap_all(handlers)
+
+    def _wrap_all(self, handlers: Iterable[Any]) -> None:
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                self._wrap_all(handler.entry_points)
+                for state in handler.states.values():
+                    self._wrap_all(state)
+                self._wrap_all(handler.fallbacks)
+            elif asyncio.iscoroutinefunction(getattr(handler, "callback", None)):
+                handler.callback = self.wrap(handler.callback.__name__)(handler.callback)
+
+    # sampling ----------------------------------------------------------------
+
+    def _sample_loop(self) -> None:
+        next_dump = time.monotonic() + self.dump_interval
+        while not self._stop.wait(self.interval):
+            self._sample()
+            if time.monotonic() >= next_dump:
+                self.dump()
+                next_dump = time.monotonic() + self.dump_interval
+
+    def _sample(self) -> None:
+        task = asyncio.current_task(self._loop)
+        name = self._tasks.get(task) if task is not None else None
+        if name is None:
+            return
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        with self._lock:
+            self.samples[f"{name};{collapse(frame)}"] += 1
+
+    def dump(self) -> Optional[str]:
+        """Write the samples collected so far as a .folded file and start over."""
+        with self._lock:
+            samples, self.samples = self.samples, Counter()
+        if not samples:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory,
+                            f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{self.dumps}.folded")
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self.dumps += 1
+        logger.info("Wrote %d profile samples to %s", sum(samples.values()), path)
+        return path
+
+    # stall detection ---------------------------------------------------------
+
+    def _beat(self) -> None:
+        self._last_beat = time.monotonic()
+        if not self._stop.is_set():
+            self._loop.call_later(self.block_threshold / 4, self._beat)
+
+    def _watch_loop(self) -> None:
+        reported = None
+        while not self._stop.wait(self.block_threshold / 2):
+            beat = self._last_beat
+            blocked = time.monotonic() - beat
+            if blocked < self.block_threshold or reported == beat:
+                continue
+            # one report per stall, with the stack that is holding the loop right now
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            task = asyncio.current_task(self._loop)
+            self.stalls += 1
+            self.recent_stalls.append({"at": time.time(), "blocked": blocked,
+                                       "handler": self._tasks.get(task, ""), "stack": stack})
+            logger.warning("Event loop blocked for %.0f ms in %s:\n%s", blocked * 1000,
+                           self._tasks.get(task) or "an unwrapped callback", stack)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": int(self.enabled),
+            "samples": sum(self.samples.values()),
+            "dumps": self.dumps,
+            "stalls": self.stalls,
+        }
+
+
+profiler = Profiler(PROFILE_DIR, PROFILE_INTERVAL, PROFILE_DUMP_INTERVAL, PROFILE_BLOCK_THRESHOLD)
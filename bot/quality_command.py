@@ -0,0 +1,31 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from bot.model_policy import LANGUAGE, QUALITY, QUALITY_LEVELS, language_code
+
+USAGE = "Usage: /quality fast|auto|best [language code or name, or auto]"
+
+
+async def quality(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/quality fast|auto|best [language] sets how your voice messages are transcribed."""
+    args = [arg.lower() for arg in context.args or []]
+    if args and args[0] not in QUALITY_LEVELS:
+        await update.message.reply_text(USAGE)
+        return
+    language = None
+    if len(args) > 1 and args[1] != "auto":
+        # whisper fails on a language it has no token for, refuse it here instead
+        language = language_code(args[1])
+        if language is None:
+            await update.message.reply_text(USAGE)
+            return
+    if args:
+        context.user_data[QUALITY] = args[0]
+    if len(args) > 1:
+        # "auto" goes back to whisper's language detection
+        context.user_data[LANGUAGE] = language
+    await update.message.reply_text(
+        f"Transcription quality: {context.user_data.get(QUALITY, 'auto')}, "
+        f"language: {context.user_data.get(LANGUAGE) or 'detected'}.\n"
+        "fast is quickest, best is most accurate, auto picks from the current load."
+    )
@@ -14,10 +14,12 @@ Press Ctrl-C on the command line or send a signal to the process to stop the
 bot.
 """
 
+import asyncio
+import functools
 import logging
-from typing import Any, Dict, Tuple
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 import os
-from dotenv import load_dotenv
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
@@ -31,11 +33,21 @@ from telegram.ext import (
 )
 
 
-import whisper
-import warnings
-
-
-from bot.utilities import getOpenAiClient, chat
+from bot.utilities import chat, is_error, StreamInterrupted
+from bot.memory import conversation_memory
+from bot.openai_client import OPENAI_CLIENT
+from bot.streaming import CURSOR, MAX_MESSAGE_LENGTH, MessageStreamRenderer
+from bot.summarizer import summarizer
+from bot.audio import decode_audio, AudioDecodeError, SAMPLE_RATE
+from bot.vad import silence_trimmer
+from bot.transcription import TranscriptionQueueFull
+from bot.whisper_batching import whisper_batcher
+from bot.long_audio import long_audio_transcriber
+from bot.transcription_cache import transcription_cache, audio_key, file_key, variant_key
+from bot import metrics
+from bot.metrics import stage_metrics
+from bot.model_policy import transcription_policy
+from config import PERSISTENCE_DB
 
 # Enable logging
 logging.basicConfig(
@@ -84,9 +96,6 @@ END = ConversationHandler.END
 
 dataDirPath = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "data")
 
-load_dotenv()
-API_KEY = os.getenv("CHATGPT_API")
-client = getOpenAiClient(API_KEY=API_KEY)
 # Helper
 def _name_switcher(level: str) -> Tuple[str, str]:
     if level == PARENTS:
@@ -95,6 +104,7 @@ def _name_switcher(level: str) -> Tuple[str, str]:
 
 
 # Top level conversation callbacks
+@metrics.handler("question")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     """Select an action: Adding parent/child or show data."""
     text = (
@@ -136,24 +146,52 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     return QUESTION
 
 
+async def transcribe_voice(voice, context: ContextTypes.DEFAULT_TYPE,
+                           on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+    """Return the transcription of a voice message, reusing cached ones when possible.
+
+    Long notes are transcribed in chunks, `on_partial` gets the text so far as they finish.
+    """
+    # model and decoding picked from the load, the note's length and the user's /quality;
+    # a text made with other settings is not the one asked for, they are part of the keys
+    decision = transcription_policy.decide(voice.duration or 0, context.user_data)
+    size, profile = decision.size, decision.profile
+    settings = (size, profile.name, profile.language)
+    key = variant_key(file_key(voice.file_unique_id), *settings)
+    # skips the download when this very file was transcribed before
+    text = transcription_cache.precheck(key)
+    if text is not None:
+        return text
+    with stage_metrics.time("get_file"):
+        file = await context.bot.get_file(voice)
+    with stage_metrics.time("download"):
+        data = bytes(await file.download_as_bytearray())
+    # the same audio uploaded again gets a new file_unique_id, fall back to its content
+    content_key = variant_key(audio_key(data), *settings)
+    text = transcription_cache.get(key, content_key)
+    if text is None:
+        # decoded in memory, concurrent voice messages never share a file
+        # 16 kHz mono, with the silences whisper would otherwise spend time on cut out
+        with stage_metrics.time("preprocess"):
+            audio = await asyncio.to_thread(lambda: silence_trimmer.trim(decode_audio(data)))
+        transcription_policy.record(decision)
+        started = time.perf_counter()
+        with stage_metrics.time("transcribe", model=size):
+            if long_audio_transcriber.is_long(audio):
+                text = await long_audio_transcriber.transcribe(audio, size, profile, on_partial)
+            else:
+                text = (await whisper_batcher.transcribe(audio, size, profile))["text"]
+        silence_trimmer.record_transcription(len(audio) / SAMPLE_RATE, time.perf_counter() - started)
+    transcription_cache.put(text, key, content_key)
+    return text
+
+
+@metrics.handler("get_question_audio")
 async def get_question_audio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
-    file = await context.bot.get_file(update.message.voice)
-    file.download_to_drive(os.path.join(dataDirPath, "user_audio.ogg"))
-    warnings.simplefilter("ignore")
-    model = whisper.load_model("tiny")
-    result = model.transcribe(audio=os.path.join(dataDirPath, "user_audio.ogg"))
-    context.user_data["question"] = result["text"]
+    context.user_data["question"] = await transcribe_voice(update.message.voice, context)
     return TRANSCRIPTION
 
-import time
-import asyncio
-async def update_dots(message):
-    dots = 0
-    while True:
-        dots = (dots + 1) % 4  # Cycling through 0, 1, 2, 3 for dot animations
-        await message.edit_text("Processing" + "." * dots)
-        await asyncio.sleep(1)
-
+@metrics.handler("get_question_text")
 async def get_question_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     if not ("transcription" in context.user_data.keys()):
         processing_message = await context.bot.send_message(chat_id=update.effective_chat.id, text="Processing your message...")
@@ -164,13 +202,23 @@ async def get_question_text(update: Update, context: ContextTypes.DEFAULT_TYPE)
             context.user_data["transcription"] = update.message.text
         # Check if the last message was a voice message
         elif message.voice:
-            file = await context.bot.get_file(update.message.voice)
-            await file.download_to_drive(os.path.join(dataDirPath, "user_audio.ogg"))
-            warnings.simplefilter("ignore")
-            model = whisper.load_model("tiny")
-            result = model.transcribe(audio=os.path.join(dataDirPath, "user_audio.ogg"))
-            context.user_data["transcription"] = result["text"]
-            # print(result)
+            # long notes show their transcript in the processing message while it is being made
+            renderer = MessageStreamRenderer(functools.partial(
+                context.bot.edit_message_text, chat_id=update.effective_chat.id,
+                message_id=processing_message.message_id))
+            try:
+                context.user_data["transcription"] = await transcribe_voice(
+                    message.voice, context,
+                    on_partial=lambda text: renderer.update(f"Processing your message...\n\n{text}"))
+            except (TranscriptionQueueFull, AudioDecodeError) as e:
+                if isinstance(e, TranscriptionQueueFull):
+                    text = "Too many voice messages right now, please try again in a moment."
+                else:
+                    logger.warning("Could not decode voice message: %s", e)
+                    text = "Sorry, I could not read this voice message."
+                await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=processing_message.message_id)
+                await update.message.reply_text(text=text)
+                return QUESTION
         else:
             text = "Please try to send a voice or a text question!!"
             await context.bot.delete_message(chat_id=update.effective_chat.id,message_id=processing_message.message_id)
@@ -229,7 +277,7 @@ async def adding_self(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str
     return DESCRIBING_SELF
 
 async def show_transcription(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
-    if context.user_data["transcription"]:
+    if context.user_data.get("transcription"):
         question = "YOUR TRANSCRIPTION IS :\n\n\t" + str(context.user_data["transcription"])
     else:
         question = "YOUR TRANSCRIPTION IS :\n\n\tNo transcription yet"
@@ -244,26 +292,59 @@ async def show_transcription(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     return SHOWING_TRANSCRIPTION
 
-async def show_transcription_summary(update: Update, context:ContextTypes.DEFAULT_TYPE) -> str:
-    if context.user_data["transcription"]:
-        question = "YOUR TRANSCRIPTION IS :\n\t" + str(context.user_data["transcription"])
-        if "summary" not in context.user_data.keys():
-            summary = await chat(MSGS=[{"role": "user", "content": f"Please summarize the following text:\n{question}"}],
-                           MaxToken=500,
-                           client=client)
-            context.user_data["summary"] = summary
-        else:
-            summary = context.user_data["summary"]
+def summary_view(transcription: str, summary: str) -> str:
+    """The transcription and its summary in one message, within Telegram's length limit.
+
+    The transcription is shortened to leave room for the summary (and the
+    streaming cursor), the user can still read all of it with "Transcription".
+    """
+    head, middle = "YOUR TRANSCRIPTION IS :\n\t", "\n\nSUMMARY :\n\t"
+    room = MAX_MESSAGE_LENGTH - len(head) - len(middle) - len(summary) - len(CURSOR)
+    if len(transcription) > room:
+        transcription = transcription[:max(0, room - 1)] + "…"
+    return f"{head}{transcription}{middle}{summary}"
 
-        question = f"{question}\n\nSUMMARY :\n\t{summary}"
-    else:
-        question = "YOUR TRANSCRIPTION IS :\n\n\tNo transcription yet"
-    user_data = context.user_data
 
+@metrics.handler("show_transcription_summary")
+async def show_transcription_summary(update: Update, context:ContextTypes.DEFAULT_TYPE) -> str:
+    user_data = context.user_data
     buttons = [[InlineKeyboardButton(text="Back", callback_data=str(END))]]
     keyboard = InlineKeyboardMarkup(buttons)
 
     await update.callback_query.answer()
+    if context.user_data.get("transcription"):
+        transcription = str(context.user_data["transcription"])
+        if "summary" not in context.user_data.keys():
+            # show the summary while it is being generated instead of waiting for all of it
+            renderer = MessageStreamRenderer(update.callback_query.edit_message_text)
+            if summarizer.is_long(transcription):
+                # the parts are summarized before the first word of the summary arrives
+                await renderer.update(summary_view(transcription, "Summarizing a long transcription..."))
+            try:
+                summary = await renderer.render(
+                    summarizer.stream(transcription,
+                                      MaxToken=500,
+                                      client=context.bot_data[OPENAI_CLIENT],
+                                      user_id=update.effective_user.id),
+                    layout=functools.partial(summary_view, transcription),
+                )
+            except StreamInterrupted as e:
+                # the partial summary is dropped, the next press of the button tries again
+                summary = str(e)
+            await renderer.finish(summary_view(transcription, summary), reply_markup=keyboard)
+            if not is_error(summary):
+                context.user_data["summary"] = summary
+                # follow-up questions in the chat can refer to the voice note
+                conversation_memory.record(update.effective_chat.id, context.chat_data,
+                                           f"Summarize my message:\n{transcription}", summary,
+                                           context.bot_data[OPENAI_CLIENT], update.effective_user.id,
+                                           context.application)
+            user_data[START_OVER] = True
+            return SHOWING_TRANSCRIPTION_SUMMARY
+        question = summary_view(transcription, context.user_data["summary"])
+    else:
+        question = "YOUR TRANSCRIPTION IS :\n\n\tNo transcription yet"
+
     await update.callback_query.edit_message_text(text=question, reply_markup=keyboard)
     user_data[START_OVER] = True
     return SHOWING_TRANSCRIPTION_SUMMARY
@@ -501,6 +582,8 @@ description_conv = ConversationHandler(
         # End conversation altogether
         STOPPING: STOPPING,
     },
+    name="description_conversation",
+    persistent=bool(PERSISTENCE_DB),
 )
 
 # Set up second level ConversationHandler (adding a person)
@@ -526,6 +609,8 @@ add_member_conv = ConversationHandler(
         # End conversation altogether
         STOPPING: END,
     },
+    name="add_member_conversation",
+    persistent=bool(PERSISTENCE_DB),
 )
 
 # Set up top level ConversationHandler (selecting action)
@@ -557,6 +642,9 @@ conv_handler = ConversationHandler(
         STOPPING: [CommandHandler("question", start)],
     },
     fallbacks=[CommandHandler("stop", stop)],
+    # the nested conversations have to be persistent as well when this one is
+    name="question_conversation",
+    persistent=bool(PERSISTENCE_DB),
 )
 
 
@@ -0,0 +1,268 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import openai
+
+from config import (
+    OPENAI_DEADLINE,
+    OPENAI_RETRIES,
+    OPENAI_BACKOFF_BASE,
+    OPENAI_BACKOFF_MAX,
+    OPENAI_HEDGE_DELAY,
+    OPENAI_BREAKER_THRESHOLD,
+    OPENAI_BREAKER_RESET,
+)
+from bot.scheduler import Slot
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fails fast after `threshold` consecutive failures, for `reset_timeout` seconds.
+
+    Once the timeout expires a single trial call is let through (half-open); its
+    outcome closes the circuit again or re-opens it.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def release_trial(self) -> None:
+        """The trial call ended without telling whether upstream is healthy, allow another."""
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial or self.failures >= self.threshold:
+            if self.opened_at is None or self._trial:
+                logger.warning("OpenAI circuit opened after %d failure(s)", self.failures)
+            self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class LatencyWindow:
+    """Latencies of the most recent successful calls."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self._samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Delay requested by the server through the Retry-After headers, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        # neither seconds nor an HTTP date, fall back to our own backoff
+        return None
+    return max(0.0, date.timestamp() - time.time()) if date else None
+
+
+class ResilientCaller:
+    """Deadline, jittered exponential backoff retries, hedging and a circuit breaker."""
+
+    def __init__(self, deadline: float = 45.0, retries: int = 3, backoff_base: float = 0.5,
+                 backoff_max: float = 8.0, hedge_delay: str = "",
+                 breaker: Optional[CircuitBreaker] = None):
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_delay = hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = LatencyWindow()
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    async def call(self, request: Callable[[], Awaitable[T]], hedge: bool = True,
+                   slot: Optional[Slot] = None, give_up_at: Optional[float] = None) -> T:
+        """Run `request()` (a factory, it may be called several times) under the policies.
+
+        With the scheduler `slot` the request was admitted in, every retry and
+        hedged duplicate is charged to the RPM/TPM buckets before it is sent.
+        `give_up_at` is the loop time the deadline ends at, when it started
+        before this call, e.g. before waiting for the slot.
+        """
+        loop = asyncio.get_running_loop()
+        if give_up_at is None:
+            give_up_at = loop.time() + self.deadline
+        elif loop.time() >= give_up_at:
+            # spent waiting on our side, not a failure of upstream
+            raise asyncio.TimeoutError()
+        trial = self._admit()
+        if trial is None:
+            raise CircuitOpenError()
+        attempt = 0
+        try:
+            while True:
+                started = loop.time()
+                try:
+                    result = await asyncio.wait_for(
+                        self._hedged(request, slot) if hedge else request(), give_up_at - started
+                    )
+                except Exception as e:
+                    if not is_retryable(e):
+                        if isinstance(e, openai.APIStatusError):
+                            # upstream answered, it is this request it refused (400, 401, ...)
+                            self.breaker.record_success()
+                        raise
+                    self.breaker.record_failure()
+                    delay = retry_after(e)
+                    if delay is None:
+                        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                    attempt += 1
+                    if attempt > self.retries or loop.time() + delay >= give_up_at:
+                        raise
+                    trial = self._admit()
+                    if trial is None:
+                        raise
+                    logger.info("Retrying OpenAI call in %.2fs after %r", delay, e)
+                    self.retried += 1
+                    await asyncio.sleep(delay)
+                    if slot is not None:
+                        # a retry storm after a 429 burst waits for capacity like new requests
+                        await asyncio.wait_for(slot.charge(), give_up_at - loop.time())
+                    continue
+                self.latencies.add(loop.time() - started)
+                self.breaker.record_success()
+                return result
+        finally:
+            if trial:
+                # cancelled or failed locally: no verdict, a later call gets to try
+                self.breaker.release_trial()
+
+    def _admit(self) -> Optional[bool]:
+        """None when the breaker refuses the call, else whether it is the half-open trial."""
+        trial = self.breaker.state == "half-open"
+        return trial if self.breaker.allow() else None
+
+    def _hedge_after(self) -> Optional[float]:
+        if not self.hedge_delay:
+            return None
+        if self.hedge_delay == "p95":
+            return self.latencies.percentile(0.95)
+        return float(self.hedge_delay)
+
+    async def _hedged(self, request: Callable[[], Awaitable[T]], slot: Optional[Slot] = None) -> T:
+        delay = self._hedge_after()
+        if delay is None:
+            return await request()
+        first = asyncio.ensure_future(request())
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+            if slot is not None and not slot.try_charge():
+                # no capacity left for a duplicate, it would only be throttled
+                return await first
+            # the first request is slower than usual, race a duplicate against it
+            self.hedged += 1
+            tasks.append(asyncio.ensure_future(request()))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "circuit": self.breaker.state,
+            "retried": self.retried,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "p95_latency": self.latencies.percentile(0.95),
+        }
+
+
+openai_resilience = ResilientCaller(
+    OPENAI_DEADLINE,
+    OPENAI_RETRIES,
+    OPENAI_BACKOFF_BASE,
+    OPENAI_BACKOFF_MAX,
+    OPENAI_HEDGE_DELAY,
+    CircuitBreaker(OPENAI_BREAKER_THRESHOLD, OPENAI_BREAKER_RESET),
+)
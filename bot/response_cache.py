@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from config import RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_DB
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def cache_key(messages: list, model: str, **params) -> str:
+    """Key of a completion request, insensitive to whitespace differences in the prompt."""
+    normalized = [
+        {key: _WHITESPACE.sub(" ", str(value)).strip() for key, value in sorted(message.items())}
+        for message in messages
+    ]
+    payload = json.dumps([normalized, model, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class SQLiteStore:
+    """Persistent store for cached answers, expired rows are ignored and pruned on write.
+
+    Writes commit to disk, ResponseCache runs them on a thread; the lock keeps
+    them from overlapping the reads done on the event loop.
+    """
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[Tuple[List[str], float]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, key: str, value: List[str], expires_at: float) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache:
+    """TTL + LRU cache of completion answers with request coalescing.
+
+    Concurrent calls for the same key share one in-flight request, whether it
+    is made by `get_or_call` or by a caller that streams the answer itself
+    (`get_or_lead`). An optional `store` (e.g. SQLiteStore) backs the in-memory
+    entries across restarts, it is written from a thread.
+    """
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_SIZE,
+                 store: Optional[SQLiteStore] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.store = store
+        self._entries: "OrderedDict[str, Tuple[List[str], float]]" = OrderedDict()
+        # key -> get_or_call's task, or the future a streaming caller settles
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # in-flight call -> callers awaiting it
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self._store_writes: Set[asyncio.Future] = set()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[List[str]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] <= time.time():
+            del self._entries[key]
+            entry = None
+        if entry is None and self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                self._remember(key, *entry)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, value: List[str]) -> None:
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self.store is not None:
+            # the commit waits on the disk, keep it off the event loop
+            write = asyncio.ensure_future(asyncio.to_thread(self.store.put, key, value, expires_at))
+            self._store_writes.add(write)
+            write.add_done_callback(self._store_writes.discard)
+
+    async def get_or_call(self, key: str, call: Callable[[], Awaitable[List[str]]],
+                          cacheable: Callable[[List[str]], bool] = lambda value: True) -> List[str]:
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            task = self._inflight.get(key)
+            if task is None:
+                self.misses += 1
+                # a task of its own, so cancelling the caller that started it does not
+                # cancel the call under the other callers waiting on it
+                task = self._inflight[key] = asyncio.ensure_future(self._call(key, call, cacheable))
+            else:
+                self.coalesced += 1
+            value = await self._wait(task)
+            if value is not None:
+                return value
+            # the stream this call joined was given up halfway, make the request after all
+
+    async def get_or_lead(self, key: str) -> Union[List[str], asyncio.Future]:
+        """The answer for `key`, cached or from the call in flight, for a caller that streams.
+
+        When there is neither, returns a future instead: the caller makes the
+        request itself and must pass the future to `settle`, concurrent callers
+        for the same key wait on it meanwhile.
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                self.misses += 1
+                future = self._inflight[key] = asyncio.get_running_loop().create_future()
+                return future
+            self.coalesced += 1
+            value = await self._wait(inflight)
+            if value is not None:
+                return value
+
+    def settle(self, key: str, future: asyncio.Future, value: Optional[List[str]],
+               cacheable: bool = True) -> None:
+        """End a call started by `get_or_lead` with its answers, or None if it was given up.
+
+        The callers waiting on it get `value`; on None they make the request themselves.
+        """
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if value is not None and cacheable:
+            self.put(key, value)
+        if not future.done():
+            future.set_result(value)
+
+    async def _wait(self, call: asyncio.Future) -> Optional[List[str]]:
+        self._waiters[call] = self._waiters.get(call, 0) + 1
+        try:
+            return await asyncio.shield(call)
+        finally:
+            self._waiters[call] -= 1
+            if not self._waiters[call]:
+                del self._waiters[call]
+                # a streaming caller settles its own future, whoever waits on it
+                if isinstance(call, asyncio.Task) and not call.done():
+                    # every caller went away, nobody wants the answer any more
+                    call.cancel()
+
+    async def _call(self, key: str, call: Callable[[], Awaitable[List[str]]],
+                    cacheable: Callable[[List[str]], bool]) -> List[str]:
+        try:
+            value = await call()
+            if cacheable(value):
+                self.put(key, value)
+            return value
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
+
+    async def close(self) -> None:
+        if self._store_writes:
+            await asyncio.gather(*self._store_writes, return_exceptions=True)
+        if self.store is not None:
+            self.store.close()
+
+    def _remember(self, key: str, value: List[str], expires_at: float) -> None:
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE,
+                               SQLiteStore(RESPONSE_CACHE_DB) if RESPONSE_CACHE_DB else None)
@@ -0,0 +1,214 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from config import OPENAI_RPM, OPENAI_TPM, OPENAI_MAX_IN_FLIGHT
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to one minute worth of capacity."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available, 0 when they are."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        # a request bigger than the bucket only has to wait for a full bucket
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        if self.rate > 0:
+            self._refill()
+            self.tokens -= amount
+
+    def refund(self, amount: float) -> None:
+        if self.rate > 0:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Job:
+    __slots__ = ("user_id", "tokens", "start", "future", "queued_at")
+
+    def __init__(self, user_id: int, tokens: int, start: float, future: asyncio.Future):
+        self.user_id = user_id
+        self.tokens = tokens
+        self.start = start
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class Slot:
+    """Permission to send one request; set `used_tokens` once the real usage is known.
+
+    A retry or a hedged duplicate of the request is another request for
+    OpenAI's limits: `charge` or `try_charge` takes the buckets' capacity for it.
+    """
+
+    def __init__(self, reserved: int, waited: float, scheduler: Optional["LLMScheduler"] = None):
+        self.reserved = reserved
+        self.waited = waited
+        self.used_tokens: Optional[int] = None
+        # TPM taken for every attempt so far, the unused part is refunded on release
+        self.charged = reserved
+        self._scheduler = scheduler
+
+    async def charge(self) -> None:
+        """Wait for the capacity of one more attempt and take it."""
+        if self._scheduler is not None:
+            await self._scheduler.charge(self)
+
+    def try_charge(self) -> bool:
+        """Take the capacity of one more attempt if it is available right now."""
+        return self._scheduler is None or self._scheduler.try_charge(self)
+
+
+class LLMScheduler:
+    """Admits OpenAI requests under the account's RPM/TPM limits.
+
+    Waiting requests are ordered by weighted fair queuing on the user id: every
+    request gets a virtual finish time of max(now, the user's last finish) +
+    tokens / weight, so a user sending many large prompts only delays their own
+    requests. At most `max_in_flight` requests run at the same time.
+    """
+
+    def __init__(self, rpm: float = 3500, tpm: float = 90000, max_in_flight: int = 32):
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.max_in_flight = max(1, max_in_flight)
+        self.in_flight = 0
+        self._queue: List[tuple] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[int, float] = defaultdict(float)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.admitted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # retries and hedges charged to already admitted requests
+        self.extra_attempts = 0
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[int], tokens: int, weight: float = 1.0,
+                   timeout: Optional[float] = None) -> AsyncIterator[Slot]:
+        """Wait for the request's turn, at most `timeout` seconds (asyncio.TimeoutError)."""
+        slot = await self._acquire(user_id if user_id is not None else 0, tokens, weight, timeout)
+        try:
+            yield slot
+        finally:
+            self._release(slot)
+
+    async def _acquire(self, user_id: int, tokens: int, weight: float,
+                       timeout: Optional[float] = None) -> Slot:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        start = max(self._virtual_time, self._last_finish[user_id])
+        finish = start + tokens / weight
+        self._last_finish[user_id] = finish
+        job = _Job(user_id, tokens, start, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, (finish, next(self._seq), job))
+        self._wakeup.set()
+        try:
+            # a timeout cancels the job, the dispatcher then skips it
+            waited = await asyncio.wait_for(job.future, timeout)
+        except asyncio.CancelledError:
+            if job.future.done() and not job.future.cancelled():
+                # granted while we were being cancelled, give the slot back
+                self._release(Slot(tokens, 0.0))
+            raise
+        return Slot(tokens, waited, self)
+
+    def _release(self, slot: Slot) -> None:
+        self.in_flight -= 1
+        if slot.used_tokens is not None and slot.used_tokens < slot.charged:
+            self.tpm.refund(slot.charged - slot.used_tokens)
+        self._wakeup.set()
+
+    async def charge(self, slot: Slot) -> None:
+        # the slot is already in flight, only the buckets are waited for
+        while not self.try_charge(slot):
+            await asyncio.sleep(max(self.rpm.wait_time(1), self.tpm.wait_time(slot.reserved)))
+
+    def try_charge(self, slot: Slot) -> bool:
+        if self.rpm.wait_time(1) > 0 or self.tpm.wait_time(slot.reserved) > 0:
+            return False
+        self.rpm.take(1)
+        self.tpm.take(slot.reserved)
+        slot.charged += slot.reserved
+        self.extra_attempts += 1
+        return True
+
+    async def _dispatch(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._queue:
+                # nobody is waiting, past finish times no longer matter
+                self._last_finish.clear()
+            while self._queue and self.in_flight < self.max_in_flight:
+                finish, _, job = self._queue[0]
+                if job.future.done():
+                    # the caller gave up while waiting
+                    heapq.heappop(self._queue)
+                    continue
+                wait = max(self.rpm.wait_time(1), self.tpm.wait_time(job.tokens))
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                heapq.heappop(self._queue)
+                self.rpm.take(1)
+                self.tpm.take(job.tokens)
+                self.in_flight += 1
+                self._virtual_time = max(self._virtual_time, job.start)
+                waited = time.monotonic() - job.queued_at
+                self.admitted += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                job.future.set_result(waited)
+
+    async def close(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+
+    def stats(self) -> Dict[str, float]:
+        queued_by_user: Dict[int, int] = defaultdict(int)
+        for _, _, job in self._queue:
+            if not job.future.done():
+                queued_by_user[job.user_id] += 1
+        return {
+            "queued": sum(queued_by_user.values()),
+            "queued_users": len(queued_by_user),
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "avg_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait": self.max_wait,
+            "extra_attempts": self.extra_attempts,
+            "rpm_available": self.rpm.tokens,
+            "tpm_available": self.tpm.tokens,
+        }
+
+
+llm_scheduler = LLMScheduler(OPENAI_RPM, OPENAI_TPM, OPENAI_MAX_IN_FLIGHT)
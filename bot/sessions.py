@@ -0,0 +1,168 @@
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, ConversationHandler
+
+from config import SESSION_IDLE_TTL, SESSION_MAX_TRANSCRIPT_BYTES
+
+logger = logging.getLogger(__name__)
+
+# user_data entries holding whole transcripts, they make up most of a session's size
+TRANSCRIPT_KEYS = ("question", "transcription", "summary")
+
+_missing_conversations_logged = False
+
+
+def transcript_bytes(user_data: Dict[Any, Any]) -> int:
+    return sum(len(value.encode()) for key in TRANSCRIPT_KEYS
+               if isinstance(value := user_data.get(key), str))
+
+
+def has_transcript(user_data: Dict[Any, Any]) -> bool:
+    return any(key in user_data for key in TRANSCRIPT_KEYS)
+
+
+def estimate_size(value: Any) -> int:
+    """Rough deep size in bytes of plain data (dicts, lists, strings, numbers)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+def conversation_handlers(handlers: Iterable[Any]) -> Iterator[ConversationHandler]:
+    """Every ConversationHandler among `handlers`, nested ones included."""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield handler
+            children = [h for state in handler.states.values() for h in state]
+            yield from conversation_handlers(handler.entry_points + children + handler.fallbacks)
+
+
+def conversation_states(handler: ConversationHandler) -> Dict[Any, Any]:
+    """The handler's conversation key -> state dict, the only private API used here.
+
+    python-telegram-bot (20.x, pinned in requirements.txt) has no public way to
+    end a conversation from outside a callback, so the sweep edits the dict the
+    handler tracks its conversations in; persistence reads the states from the
+    same dict. Should a future release rename it, conversations are simply not
+    swept (logged once), the transcripts still are.
+    """
+    global _missing_conversations_logged
+    conversations = getattr(handler, "_conversations", None)
+    if not isinstance(conversations, dict):
+        if not _missing_conversations_logged:
+            _missing_conversations_logged = True
+            logger.warning("ConversationHandler._conversations is gone, conversations are not swept")
+        return {}
+    return conversations
+
+
+class SessionSweeper:
+    """Evicts the transcripts and conversation states of users who went idle.
+
+    Every update refreshes its user's last activity. The sweep job drops the
+    sessions idle for more than `idle_ttl` seconds, then, while the transcripts
+    stored across all sessions exceed `max_transcript_bytes`, the least recently
+    active ones. An evicted user simply starts over with /question; the rest of
+    their user_data, like the /quality preferences, is kept.
+    """
+
+    def __init__(self, idle_ttl: float, max_transcript_bytes: int):
+        self.idle_ttl = idle_ttl
+        self.max_transcript_bytes = max_transcript_bytes
+        # user id -> monotonic time of the last update, least recently active first
+        self._last_seen: "OrderedDict[int, float]" = OrderedDict()
+        self.expired = 0
+        self.evicted = 0
+        self._last_stats: Dict[str, int] = {}
+
+    async def touch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """TypeHandler callback run ahead of every other handler."""
+        if update.effective_user is not None:
+            self._last_seen[update.effective_user.id] = time.monotonic()
+            self._last_seen.move_to_end(update.effective_user.id)
+
+    async def sweep(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """JobQueue callback."""
+        self.sweep_application(context.application)
+
+    def sweep_application(self, application: Application) -> List[int]:
+        now = time.monotonic()
+        user_data = application.user_data
+        # sessions loaded from persistence count as active from the first sweep on
+        for user_id, data in user_data.items():
+            if has_transcript(data):
+                self._last_seen.setdefault(user_id, now)
+        idle = [user_id for user_id, seen in self._last_seen.items() if now - seen > self.idle_ttl]
+        self.expired += len(idle)
+
+        idle_set = set(idle)
+        total = sum(transcript_bytes(data) for user_id, data in user_data.items()
+                    if user_id not in idle_set)
+        over_cap = []
+        for user_id in self._last_seen:
+            if total <= self.max_transcript_bytes:
+                break
+            if user_id in idle_set:
+                continue
+            total -= transcript_bytes(user_data.get(user_id, {}))
+            over_cap.append(user_id)
+        self.evicted += len(over_cap)
+
+        dropped = idle + over_cap
+        if dropped:
+            self._drop(application, dropped)
+            logger.info("Dropped %d idle and %d least recently used session(s)",
+                        len(idle), len(over_cap))
+        self._last_stats = self._measure(application)
+        return dropped
+
+    def _drop(self, application: Application, user_ids: List[int]) -> None:
+        users = set(user_ids)
+        for user_id in user_ids:
+            self._last_seen.pop(user_id, None)
+            data = application.user_data.get(user_id)
+            if data is None:
+                continue
+            for key in TRANSCRIPT_KEYS:
+                data.pop(key, None)
+            if data:
+                # preferences and the like stay, persistence stores the trimmed dict
+                application.mark_data_for_update_persistence(user_ids=user_id)
+            else:
+                # also deletes the row when persistence is enabled
+                application.drop_user_data(user_id)
+        for handler in conversation_handlers(application.handlers.get(0, [])):
+            conversations = conversation_states(handler)
+            for key in [key for key in conversations if key and key[-1] in users]:
+                conversations.pop(key, None)
+
+    def _measure(self, application: Application) -> Dict[str, int]:
+        user_data = application.user_data
+        return {
+            "sessions": len(user_data),
+            "tracked_users": len(self._last_seen),
+            "conversations": sum(len(conversation_states(handler)) for handler in
+                                 conversation_handlers(application.handlers.get(0, []))),
+            "transcript_bytes": sum(transcript_bytes(data) for data in user_data.values()),
+            "estimated_bytes": sum(estimate_size(data) for data in user_data.values()),
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """Counts of the last sweep plus the eviction totals."""
+        return {
+            **self._last_stats,
+            "max_transcript_bytes": self.max_transcript_bytes,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+session_sweeper = SessionSweeper(SESSION_IDLE_TTL, SESSION_MAX_TRANSCRIPT_BYTES)
@@ -1,7 +1,9 @@
 from telegram.ext import ContextTypes
 from telegram import Update
 from config import menu_message
+from bot import metrics
 
+@metrics.handler("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await context.bot.send_message(chat_id=update.effective_chat.id, text=menu_message)
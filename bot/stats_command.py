@@ -0,0 +1,20 @@
+import html
+
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+
+from config import ADMIN_USER_IDS
+from bot.metrics import stage_metrics, format_stats
+from bot.streaming import MAX_MESSAGE_LENGTH
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin only: the current per-stage latency percentiles."""
+    if update.effective_user is None or update.effective_user.id not in ADMIN_USER_IDS:
+        # ignored like an unknown command, the command is not advertised
+        return
+    table = format_stats(stage_metrics.percentiles())
+    # keep the closing tag inside Telegram's limit
+    table = html.escape(table)[:MAX_MESSAGE_LENGTH - len("<pre></pre>")]
+    await update.message.reply_text(f"<pre>{table}</pre>", parse_mode=ParseMode.HTML)
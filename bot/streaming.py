@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from telegram.error import BadRequest, RetryAfter
+
+from config import STREAM_EDIT_INTERVAL
+from bot.metrics import stage_metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram refuses messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+CURSOR = " ▌"
+
+
+class MessageStreamRenderer:
+    """Progressively edits a message while a text is being generated.
+
+    Edits are coalesced: the first piece of text is shown right away, then at
+    most one edit is sent every `min_interval` seconds with everything received
+    in between. `finish` shows the final text at once, without waiting for
+    the interval.
+    """
+
+    def __init__(self, edit: Callable[..., Awaitable], min_interval: float = STREAM_EDIT_INTERVAL,
+                 cursor: str = CURSOR):
+        self._edit = edit
+        self.min_interval = min_interval
+        self.cursor = cursor
+        self._shown = None
+        self._next_edit = 0.0
+        self.edits = 0
+
+    async def update(self, text: str) -> None:
+        if time.monotonic() < self._next_edit:
+            return
+        await self._show(text + self.cursor)
+
+    async def finish(self, text: str, **kwargs) -> None:
+        # sent right away, it replaces the edit the interval would have held back;
+        # a RetryAfter from Telegram is still waited out by _show
+        await self._show(text, force=True, **kwargs)
+
+    async def render(self, pieces: AsyncIterator[str], prefix: str = "",
+                     layout: Optional[Callable[[str], str]] = None) -> str:
+        """Consume `pieces`, keep the message up to date and return the generated text.
+
+        The message shows `prefix` and the text so far, or `layout(text so far)`.
+        """
+        text = ""
+        async for piece in pieces:
+            text += piece
+            await self.update(layout(text) if layout is not None else prefix + text)
+        return text
+
+    async def _show(self, text: str, force: bool = False, **kwargs) -> None:
+        text = text[:MAX_MESSAGE_LENGTH]
+        if text == self._shown and not kwargs:
+            return
+        try:
+            with stage_metrics.time("edit_message_text"):
+                await self._edit(text=text, **kwargs)
+            self._shown = text
+            self.edits += 1
+        except RetryAfter as e:
+            if not force:
+                self._next_edit = time.monotonic() + e.retry_after
+                return
+            await asyncio.sleep(e.retry_after)
+            await self._edit(text=text, **kwargs)
+            self._shown = text
+        except BadRequest as e:
+            # raised when the text did not change since the last edit
+            if "not modified" not in str(e):
+                raise
+        self._next_edit = time.monotonic() + self.min_interval
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from config import OPENAI_MODEL, SUMMARY_CHUNK_TOKENS, SUMMARY_CONCURRENCY, SUMMARY_MAP_TOKENS
+from bot.tokens import count_text_tokens
+from bot.utilities import chat, chat_stream, is_error
+
+logger = logging.getLogger(__name__)
+
+SUMMARIZE_PROMPT = "Please summarize the following text:\n{text}"
+MAP_PROMPT = ("The following is part {part} of {parts} of a longer transcription. "
+              "Summarize this part, keeping every fact, name and number:\n{text}")
+REDUCE_PROMPT = ("The following are summaries of consecutive parts of one transcription. "
+                 "Combine them into a single summary of the whole text:\n{text}")
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence for sentence in _SENTENCE_END.split(text.strip()) if sentence]
+
+
+def chunk_text(text: str, budget: int, model: str = OPENAI_MODEL) -> List[str]:
+    """Consecutive runs of whole sentences of at most `budget` tokens each.
+
+    A sentence longer than the budget on its own, as in unpunctuated
+    transcriptions, is cut between words.
+    """
+    pieces = []
+    for sentence in split_sentences(text):
+        if count_text_tokens(sentence, model) <= budget:
+            pieces.append(sentence)
+            continue
+        words: List[str] = []
+        for word in sentence.split():
+            if words and count_text_tokens(" ".join(words + [word]), model) > budget:
+                pieces.append(" ".join(words))
+                words = []
+            words.append(word)
+        if words:
+            pieces.append(" ".join(words))
+
+    chunks, current, used = [], [], 0
+    for piece in pieces:
+        # +1 for the space joining the pieces
+        tokens = count_text_tokens(piece, model) + 1
+        if current and used + tokens > budget:
+            chunks.append(" ".join(current))
+            current, used = [], 0
+        current.append(piece)
+        used += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class SummaryError(Exception):
+    """A chunk could not be summarized, the message is the error answer of the call."""
+
+
+class Summarizer:
+    """Summarizes texts of any length within the model's context window.
+
+    Texts of at most `chunk_tokens` tokens are summarized by one streamed call
+    as before. Longer ones are split into sentence chunks of that size, each
+    summarized on its own with at most `concurrency` calls in flight (map); the
+    chunk summaries are then combined into the final, streamed, summary
+    (reduce). When the chunk summaries themselves do not fit in one chunk they
+    are combined group by group first, as many levels as it takes.
+    """
+
+    def __init__(self, chunk_tokens: int = 2000, concurrency: int = 4, map_tokens: int = 250,
+                 model: str = OPENAI_MODEL):
+        self.chunk_tokens = chunk_tokens
+        self.concurrency = concurrency
+        self.map_tokens = map_tokens
+        self.model = model
+        self.single = 0
+        self.hierarchical = 0
+        self.chunks = 0
+        self.levels = 0
+
+    def is_long(self, text: str) -> bool:
+        return count_text_tokens(text, self.model) > self.chunk_tokens
+
+    async def stream(self, text: str, MaxToken: int = 500, client: Any = None,
+                     user_id: Optional[int] = None) -> AsyncIterator[str]:
+        """Yield the summary of `text` piece by piece, like chat_stream."""
+        if not self.is_long(text):
+            self.single += 1
+            prompt = SUMMARIZE_PROMPT.format(text=text)
+        else:
+            self.hierarchical += 1
+            try:
+                partials = await self._map(chunk_text(text, self.chunk_tokens, self.model),
+                                           MAP_PROMPT, client, user_id)
+                combined = "\n\n".join(partials)
+                while count_text_tokens(combined, self.model) > self.chunk_tokens:
+                    partials = await self._map(self._groups(partials), REDUCE_PROMPT, client, user_id)
+                    combined = "\n\n".join(partials)
+            except SummaryError as e:
+                yield str(e)
+                return
+            prompt = REDUCE_PROMPT.format(text=combined)
+        async for piece in chat_stream(MSGS=[{"role": "user", "content": prompt}], MaxToken=MaxToken,
+                                       client=client, user_id=user_id):
+            yield piece
+
+    def _groups(self, partials: List[str]) -> List[str]:
+        groups = chunk_text("\n\n".join(partials), self.chunk_tokens, self.model)
+        if len(groups) >= len(partials):
+            # summaries too long to pair up, halve the list so every level shrinks it
+            middle = len(partials) // 2
+            groups = ["\n\n".join(partials[:middle]), "\n\n".join(partials[middle:])]
+        return groups
+
+    async def _map(self, chunks: List[str], template: str, client: Any,
+                   user_id: Optional[int]) -> List[str]:
+        self.levels += 1
+        self.chunks += len(chunks)
+        logger.info("Summarizing %d chunks, %d at a time", len(chunks), self.concurrency)
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def summarize(i: int, chunk: str) -> str:
+            prompt = template.format(part=i + 1, parts=len(chunks), text=chunk)
+            async with slots:
+                answer = await chat(MSGS=[{"role": "user", "content": prompt}],
+                                    MaxToken=self.map_tokens, client=client, user_id=user_id)
+            if is_error(answer):
+                raise SummaryError(answer)
+            return answer
+
+        tasks = [asyncio.ensure_future(summarize(i, chunk)) for i, chunk in enumerate(chunks)]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            # one failed chunk fails the summary, the others are not worth finishing
+            for task in tasks:
+                task.cancel()
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "single": self.single,
+            "hierarchical": self.hierarchical,
+            "chunks": self.chunks,
+            "levels": self.levels,
+        }
+
+
+summarizer = Summarizer(SUMMARY_CHUNK_TOKENS, SUMMARY_CONCURRENCY, SUMMARY_MAP_TOKENS)
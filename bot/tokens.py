@@ -0,0 +1,96 @@
+import logging
+import math
+from typing import Dict, Optional
+
+try:
+    import tiktoken
+except ImportError:  # the heuristic below is used instead
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# prompt + completion tokens accepted by each model
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-1106-preview": 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# USD per 1000 (prompt, completion) tokens
+PRICES = {
+    "gpt-3.5-turbo": (0.0010, 0.0020),
+    "gpt-3.5-turbo-16k": (0.0030, 0.0040),
+    "gpt-3.5-turbo-1106": (0.0010, 0.0020),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4-1106-preview": (0.01, 0.03),
+}
+
+# chat format overhead, see openai-cookbook "How to count tokens with tiktoken"
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_REPLY_PRIMING = 3
+
+
+# model -> its encoding, or None to estimate; filled by load_encoding only
+_encodings: Dict[str, Optional["tiktoken.Encoding"]] = {}
+
+
+def load_encoding(model: str) -> None:
+    """Resolve the tiktoken encoding of `model`, blocking, call it in a thread.
+
+    The first use of an encoding downloads its BPE ranks (tiktoken caches them
+    on disk, see TIKTOKEN_CACHE_DIR). Until this has run for a model its
+    tokens are estimated, so no request ever waits on that download.
+    """
+    if tiktoken is None:
+        _encodings[model] = None
+        return
+    try:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # without network, or a cached copy of the ranks, we estimate
+        logger.warning("tiktoken encoding unavailable, estimating token counts: %s", e)
+        _encodings[model] = None
+
+
+def count_text_tokens(text: str, model: str) -> int:
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # english averages ~4 characters per token; never count fewer tokens than words
+    return max(math.ceil(len(text) / 4), len(text.split()))
+
+
+def count_message_tokens(messages: list, model: str) -> int:
+    """Prompt tokens of a chat completion request."""
+    total = TOKENS_REPLY_PRIMING
+    for message in messages:
+        total += TOKENS_PER_MESSAGE
+        for key, value in message.items():
+            total += count_text_tokens(str(value), model)
+            if key == "name":
+                total += TOKENS_PER_NAME
+    return total
+
+
+def context_window(model: str) -> int:
+    return CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+def completion_budget(messages: list, model: str, requested: int) -> int:
+    """`max_tokens` that still fits the model's context window, 0 if the prompt does not fit."""
+    remaining = context_window(model) - count_message_tokens(messages, model)
+    return max(0, min(requested, remaining))
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = PRICES.get(model, PRICES["gpt-3.5-turbo"])
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
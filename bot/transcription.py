@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from config import TRANSCRIBE_WORKERS, TRANSCRIBE_QUEUE_SIZE
+from bot.whisper_models import WhisperModelRegistry, whisper_registry
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionQueueFull(Exception):
+    """Raised when too many voice messages are already waiting for a worker."""
+
+
+class TranscriptionService:
+    """Runs whisper on a thread pool so the event loop keeps serving other chats.
+
+    Torch releases the GIL inside its kernels, so threads give real parallelism
+    while sharing the models loaded by the registry. Admission is bounded: once
+    `max_queue` jobs are waiting, `transcribe` raises TranscriptionQueueFull
+    instead of letting the backlog grow.
+    """
+
+    def __init__(self, registry: WhisperModelRegistry, workers: int = 1, max_queue: int = 16):
+        self.registry = registry
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # submitted to the pool and not started by a worker yet
+        self._queued = 0
+        self._running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="whisper")
+        logger.info("Transcription pool started: %d worker(s)", self.workers)
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._executor = None
+        logger.info("Transcription pool stopped")
+
+    @property
+    def queue_depth(self) -> int:
+        """Jobs accepted but not picked up by a worker yet."""
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        """Jobs a worker is busy with."""
+        return self._running
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "running": self._running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    async def transcribe(self, audio: Any, size: Optional[str] = None, **options) -> dict:
+        """Transcribe `audio` (a path or a float32 array) and return whisper's result dict."""
+        return await self._submit(lambda model: model.transcribe(audio, **cpu_options(model, options)),
+                                  size)
+
+    async def transcribe_batch(self, clips: List[np.ndarray], size: Optional[str] = None,
+                               **options) -> List[str]:
+        """Transcribe clips of at most 30 s in a single forward pass, one job for the pool."""
+        return await self._submit(lambda model: decode_batch(model, clips, **options), size)
+
+    async def _submit(self, work: Callable[[Any], Any], size: Optional[str]) -> Any:
+        if self._executor is None:
+            self.start()
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise TranscriptionQueueFull()
+        with self._lock:
+            self._queued += 1
+        try:
+            job = self._executor.submit(self._run, work, size)
+        except BaseException:
+            with self._lock:
+                self._queued -= 1
+            raise
+        try:
+            return await asyncio.wrap_future(job)
+        except asyncio.CancelledError:
+            # cancelling the wrapper cancels the job only if no worker started it
+            if job.cancelled():
+                with self._lock:
+                    self._queued -= 1
+            raise
+
+    def _run(self, work: Callable[[Any], Any], size: Optional[str]) -> Any:
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        failed = True
+        try:
+            with self.registry.lease(size) as model:
+                result = work(model)
+            failed = False
+            return result
+        finally:
+            with self._lock:
+                self._running -= 1
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+
+
+def cpu_options(model: Any, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Decoding options with the CPU defaults filled in.
+
+    fp16 is only requested off the CPU; on it whisper would warn and fall back
+    to fp32 on every call, and a quantized model has no fp16 path at all.
+    """
+    options = dict(options)
+    options.setdefault("fp16", model.device.type != "cpu")
+    return options
+
+
+def decode_batch(model: Any, clips: List[np.ndarray], **options) -> List[str]:
+    """Run whisper's encoder and decoder once over several clips.
+
+    Every clip is padded or trimmed to one 30 s log-mel segment, so longer audio
+    must go through `model.transcribe`. Unlike transcribe there is no temperature
+    fallback, which is fine for the short voice notes this is used for.
+    """
+    import torch
+    import whisper
+
+    mels = torch.stack([
+        whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(clip)), model.dims.n_mels)
+        for clip in clips
+    ]).to(model.device)
+    results = whisper.decode(model, mels, whisper.DecodingOptions(**cpu_options(model, options)))
+    return [result.text for result in results]
+
+
+transcription_service = TranscriptionService(whisper_registry, TRANSCRIBE_WORKERS,
+                                             TRANSCRIBE_QUEUE_SIZE)
@@ -0,0 +1,137 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import TRANSCRIPTION_CACHE_BYTES, TRANSCRIPTION_CACHE_DB
+
+
+def audio_key(data: bytes) -> str:
+    """Content key used when a message carries no file_unique_id."""
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def file_key(file_unique_id: str) -> str:
+    return "tg:" + file_unique_id
+
+
+def variant_key(key: str, model: str, profile: str, language: Optional[str]) -> str:
+    """`key` of the text a given whisper model and decoding profile made of the audio."""
+    return f"{key}|{model}|{profile}|{language or 'detected'}"
+
+
+class TranscriptionCache:
+    """Two tier cache of transcriptions.
+
+    The first tier is an in-memory LRU bounded by the total size of the stored
+    texts. The optional second tier is a sqlite table that survives restarts;
+    its hits are promoted back to memory.
+    """
+
+    def __init__(self, max_bytes: int = TRANSCRIPTION_CACHE_BYTES, db_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS transcriptions (key TEXT PRIMARY KEY, text TEXT NOT NULL)"
+            )
+            self._db.commit()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.precheck_hits = 0
+        self.precheck_misses = 0
+
+    def get(self, *keys: str) -> Optional[str]:
+        """Return the text stored under the first matching key, counted as one lookup."""
+        with self._lock:
+            text, tier = self._lookup(keys)
+            if tier == "memory":
+                self.hits += 1
+            elif tier == "disk":
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+            return text
+
+    def precheck(self, key: str) -> Optional[str]:
+        """`get` for the file id known before the download, with counters of its own.
+
+        A miss here is followed by the real lookup, counting it in `misses` too
+        would count every new voice note twice.
+        """
+        with self._lock:
+            text, _ = self._lookup((key,))
+            if text is None:
+                self.precheck_misses += 1
+            else:
+                self.precheck_hits += 1
+            return text
+
+    def _lookup(self, keys) -> Tuple[Optional[str], Optional[str]]:
+        for key in keys:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                return text, "memory"
+        if self._db is not None:
+            for key in keys:
+                row = self._db.execute(
+                    "SELECT text FROM transcriptions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self._store(key, row[0])
+                    return row[0], "disk"
+        return None, None
+
+    def put(self, text: str, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._store(key, text)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO transcriptions (key, text) VALUES (?, ?)",
+                    [(key, text) for key in keys],
+                )
+                self._db.commit()
+
+    def _store(self, key: str, text: str) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old.encode())
+        size = len(text.encode())
+        if size > self.max_bytes:
+            return
+        self._entries[key] = text
+        self._size += size
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted.encode())
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "precheck_hits": self.precheck_hits,
+            "precheck_misses": self.precheck_misses,
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+transcription_cache = TranscriptionCache(TRANSCRIPTION_CACHE_BYTES, TRANSCRIPTION_CACHE_DB or None)
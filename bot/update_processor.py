@@ -0,0 +1,84 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import CONCURRENT_UPDATES
+
+# the base class semaphore is taken before our per-chat lock, which would let
+# updates queued behind a busy chat hold global slots, so it is effectively disabled
+_UNBOUNDED = 2 ** 31 - 1
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different chats concurrently, and those of one chat in order.
+
+    Updates are keyed like ConversationHandler's default (chat id, user id), so a
+    user double-tapping a button can not run two steps of the same conversation
+    at once. At most `max_concurrent` updates run at the same time overall.
+    """
+
+    def __init__(self, max_concurrent: int):
+        super().__init__(_UNBOUNDED)
+        self.max_concurrent = max(1, max_concurrent)
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._depth: Dict[Hashable, int] = {}
+        self.running = 0
+
+    @staticmethod
+    def key(update: Any) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        if not isinstance(update, Update):
+            return None
+        chat, user = update.effective_chat, update.effective_user
+        if chat is None and user is None:
+            return None
+        return (chat.id if chat else None, user.id if user else None)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+        self._depth[key] = self._depth.get(key, 0) + 1
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            # asyncio.Lock wakes its waiters first in, first out
+            async with lock:
+                await self._run(coroutine)
+        finally:
+            self._depth[key] -= 1
+            if not self._depth[key]:
+                del self._depth[key]
+                del self._locks[key]
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        async with self._slots:
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def queue_depths(self) -> Dict[Hashable, int]:
+        """Updates waiting or running for every chat/user key that has any."""
+        return dict(self._depth)
+
+    def stats(self) -> Dict[str, int]:
+        depths = self._depth.values()
+        return {
+            "running": self.running,
+            "active_keys": len(self._depth),
+            "queued": max(0, sum(depths) - self.running),
+            "max_key_depth": max(depths, default=0),
+        }
+
+
+update_processor = PerChatUpdateProcessor(CONCURRENT_UPDATES)
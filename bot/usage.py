@@ -0,0 +1,51 @@
+from collections import defaultdict
+from typing import Dict, Optional
+
+from bot.tokens import cost
+
+
+class UsageCounter:
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def add(self, prompt_tokens: int, completion_tokens: int, usd: float) -> None:
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost += usd
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "cost_usd": round(self.cost, 6),
+        }
+
+
+class UsageTracker:
+    """Token and cost counters for the whole process and for every user."""
+
+    def __init__(self):
+        self.total = UsageCounter()
+        self.users: Dict[int, UsageCounter] = defaultdict(UsageCounter)
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int,
+               user_id: Optional[int] = None) -> None:
+        usd = cost(model, prompt_tokens, completion_tokens)
+        self.total.add(prompt_tokens, completion_tokens, usd)
+        if user_id is not None:
+            self.users[user_id].add(prompt_tokens, completion_tokens, usd)
+
+    def user(self, user_id: int) -> Dict[str, float]:
+        return self.users[user_id].as_dict() if user_id in self.users else UsageCounter().as_dict()
+
+    def stats(self) -> Dict[str, float]:
+        return {**self.total.as_dict(), "users": len(self.users)}
+
+
+usage_tracker = UsageTracker()
@@ -1,32 +1,174 @@
+import asyncio
+from openai import AsyncOpenAI
+from typing import Any, AsyncIterator, List, Optional
 
+from config import OPENAI_MODEL
+from bot.tokens import completion_budget, count_message_tokens, count_text_tokens
+from bot.usage import usage_tracker
+from bot.response_cache import response_cache, cache_key
+from bot.resilience import openai_resilience, CircuitOpenError
+from bot.scheduler import llm_scheduler
+from bot.metrics import stage_metrics
+from bot.profiling import profiler
 
-from openai import AsyncOpenAI
-from typing import Any
-def getOpenAiClient(API_KEY: str):
-    return AsyncOpenAI(api_key=API_KEY)
+UNAVAILABLE = "Error: the AI service is temporarily unavailable, please try again in a minute."
+
+
+class StreamInterrupted(Exception):
+    """chat_stream failed after part of the answer was yielded, the message is the error text.
+
+    An error before the first piece is yielded as the answer, as chat() returns
+    it; after it, appending the error would make it look like part of the text.
+    """
+
+
+def is_error(answer: str) -> bool:
+    """Failures are returned as text, this tells them from an answer."""
+    return answer.startswith(("Error", "ERROR", "No response"))
+
+
+def _cacheable(answers: List[str]) -> bool:
+    # an error must not be served to the next user
+    return not is_error(answers[0])
+
+
+def getOpenAiClient(API_KEY: str, http_client: Any=None, base_url: Optional[str]=None,
+                    max_retries: int=2):
+    return AsyncOpenAI(api_key=API_KEY, http_client=http_client, base_url=base_url,
+                       max_retries=max_retries)
 
-async def chat(MSGS: list, MaxToken: int=50, outputs: int=3, client: Any=None) -> str:
+
+async def chat_choices(MSGS: list, MaxToken: int=50, outputs: int=1, client: Any=None,
+                       user_id: Optional[int]=None, use_cache: bool=True) -> List[str]:
+    if not client:
+        return ["ERROR: API client not provided"]
+    if not use_cache:
+        return await _create(MSGS, MaxToken, outputs, client, user_id)
+    key = cache_key(MSGS, OPENAI_MODEL, max_tokens=MaxToken, n=outputs)
+    return await response_cache.get_or_call(
+        key, lambda: _create(MSGS, MaxToken, outputs, client, user_id), _cacheable
+    )
+
+
+async def _create(MSGS: list, MaxToken: int, outputs: int, client: Any,
+                  user_id: Optional[int]) -> List[str]:
     # We use the Chat Completion endpoint for chat like inputs
+    # max_tokens generated by the AI model, shrunk so prompt + answer fit the context window
+    max_tokens = completion_budget(MSGS, OPENAI_MODEL, MaxToken)
+    if max_tokens <= 0:
+        return ["Error: the message is too long for the AI model"]
+    params = {}
+    if outputs > 1:
+        # number of output variations to be generated by AI model, each one is billed
+        params["n"] = outputs
+    # TPM is reserved for the worst case and the unused part refunded afterwards
+    reserved = count_message_tokens(MSGS, OPENAI_MODEL) + max_tokens * outputs
+    # the deadline covers the wait for a slot too, not only the request
+    give_up_at = asyncio.get_running_loop().time() + openai_resilience.deadline
+    try:
+        with stage_metrics.time("chat", model=OPENAI_MODEL):
+            async with llm_scheduler.slot(user_id, reserved, timeout=openai_resilience.deadline) as slot:
+                # deadline, retries on 429/5xx, optional hedging and the circuit breaker
+                response = await openai_resilience.call(lambda: client.chat.completions.create(
+                # gpt-4, gpt-4-0314, gpt-4-32k, gpt-4-32k-0314,
+                # gpt-3.5-turbo, gpt-3.5-turbo-0301
+                model=OPENAI_MODEL,
+                # MSGS=[
+                #     {"role": "system", "content": "<message generated by system>"},
+                #     {"role": "user", "content": "<message generated by user>"},
+                #     {"role": "assistant", "content": "<message generated by assistant>"}
+                # ]
+                messages=MSGS,
+                max_tokens = max_tokens,
+                **params,
+                ), slot=slot, give_up_at=give_up_at)
+                if response and response.usage:
+                    slot.used_tokens = response.usage.total_tokens
+    except CircuitOpenError:
+        return [UNAVAILABLE]
+    except asyncio.TimeoutError:
+        return ["Error: the AI model took too long to answer"]
+    except Exception as e:
+        return [f"Error: {str(e)}"]
+    if not response or not response.choices:
+        return ["No response from AI model"]
+    if response.usage:
+        usage_tracker.record(OPENAI_MODEL, response.usage.prompt_tokens,
+                             response.usage.completion_tokens, user_id)
+    return [choice.message.content for choice in response.choices]
+
+
+@profiler.wrap("chat")
+async def chat(MSGS: list, MaxToken: int=50, client: Any=None, user_id: Optional[int]=None,
+               use_cache: bool=True) -> str:
+    return (await chat_choices(MSGS, MaxToken=MaxToken, client=client, user_id=user_id,
+                               use_cache=use_cache))[0]
+
+
+async def chat_stream(MSGS: list, MaxToken: int=50, client: Any=None,
+                      user_id: Optional[int]=None) -> AsyncIterator[str]:
+    # Same request as chat() but yields the answer piece by piece as the tokens arrive
     if not client:
-        return "ERROR: API client not provided"
+        yield "ERROR: API client not provided"
+        return
+    key = cache_key(MSGS, OPENAI_MODEL, max_tokens=MaxToken, n=1)
+    # the same request from chat() or another stream is waited on, not made twice
+    inflight = await response_cache.get_or_lead(key)
+    if not isinstance(inflight, asyncio.Future):
+        yield inflight[0]
+        return
+    max_tokens = completion_budget(MSGS, OPENAI_MODEL, MaxToken)
+    if max_tokens <= 0:
+        response_cache.settle(key, inflight, ["Error: the message is too long for the AI model"],
+                              cacheable=False)
+        yield "Error: the message is too long for the AI model"
+        return
+    answer = ""
+    prompt_tokens = count_message_tokens(MSGS, OPENAI_MODEL)
+    loop = asyncio.get_running_loop()
+    # one deadline from the wait for a slot to the last token
+    give_up_at = loop.time() + openai_resilience.deadline
     try:
-        response = await client.chat.completions.create(
-        # gpt-4, gpt-4-0314, gpt-4-32k, gpt-4-32k-0314,
-        # gpt-3.5-turbo, gpt-3.5-turbo-0301
-        model="gpt-3.5-turbo",
-        # MSGS=[
-        #     {"role": "system", "content": "<message generated by system>"},
-        #     {"role": "user", "content": "<message generated by user>"},
-        #     {"role": "assistant", "content": "<message generated by assistant>"}
-        # ]
-        messages=MSGS,
-        # max_tokens generated by the AI model
-        # maximu value can be 4096 tokens for "gpt-3.5-turbo"
-        max_tokens = MaxToken,
-        # number of output variations to be generated by AI model
-        n = outputs,
-        )
+        with stage_metrics.time("chat", model=OPENAI_MODEL):
+            async with llm_scheduler.slot(user_id, prompt_tokens + max_tokens,
+                                          timeout=openai_resilience.deadline) as slot:
+                # only opening the stream is retried, a half streamed answer is never replayed
+                stream = await openai_resilience.call(lambda: client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=MSGS,
+                    max_tokens=max_tokens,
+                    stream=True,
+                ), hedge=False, slot=slot, give_up_at=give_up_at)
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), give_up_at - loop.time())
+                    except StopAsyncIteration:
+                        break
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        answer += chunk.choices[0].delta.content
+                        yield chunk.choices[0].delta.content
+                slot.used_tokens = prompt_tokens + count_text_tokens(answer, OPENAI_MODEL)
+        if answer:
+            response_cache.settle(key, inflight, [answer])
+    except CircuitOpenError:
+        response_cache.settle(key, inflight, [UNAVAILABLE], cacheable=False)
+        yield UNAVAILABLE
+    except asyncio.TimeoutError as e:
+        if answer:
+            raise StreamInterrupted("Error: the AI model took too long to answer") from e
+        response_cache.settle(key, inflight, ["Error: the AI model took too long to answer"],
+                              cacheable=False)
+        yield "Error: the AI model took too long to answer"
     except Exception as e:
-        return f"Error: {str(e)}"
-    print(response.choices[0].message)
-    return response.choices[0].message.content if response and response.choices else "No response from AI model"
\ No newline at end of file
+        if answer:
+            raise StreamInterrupted(f"Error: {str(e)}") from e
+        response_cache.settle(key, inflight, [f"Error: {str(e)}"], cacheable=False)
+        yield f"Error: {str(e)}"
+    finally:
+        # interrupted or given up by the reader: whoever waits makes the request again
+        response_cache.settle(key, inflight, None)
+        # streamed responses carry no usage block, count both sides locally
+        if answer:
+            usage_tracker.record(OPENAI_MODEL, prompt_tokens,
+                                 count_text_tokens(answer, OPENAI_MODEL), user_id)
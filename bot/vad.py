@@ -0,0 +1,101 @@
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config import VAD_ENABLED, VAD_MARGIN_DB, VAD_MIN_SILENCE, VAD_PADDING
+from bot.audio import SAMPLE_RATE
+
+# 30 ms analysis frames, the usual WebRTC VAD frame length
+FRAME = int(0.03 * SAMPLE_RATE)
+# frames quieter than this are silence whatever the noise floor of the recording
+ABSOLUTE_FLOOR_DB = -50.0
+
+
+def frame_energy_db(audio: np.ndarray) -> np.ndarray:
+    frames = audio[:len(audio) // FRAME * FRAME].reshape(-1, FRAME)
+    return 10 * np.log10(np.mean(frames.astype(np.float64) ** 2, axis=1) + 1e-10)
+
+
+def speech_regions(audio: np.ndarray, margin_db: float = 10.0, min_silence: float = 0.5,
+                   padding: float = 0.2) -> List[Tuple[int, int]]:
+    """Sample ranges holding speech, as detected by an adaptive energy threshold.
+
+    The noise floor is the 10th percentile of the frame energies; frames more
+    than `margin_db` above it are speech. Silences shorter than `min_silence`
+    seconds are kept, and every region grows by `padding` seconds on each side
+    so word onsets and endings are not clipped.
+    """
+    energy = frame_energy_db(audio)
+    if not len(energy):
+        return []
+    threshold = max(ABSOLUTE_FLOOR_DB, np.percentile(energy, 10) + margin_db)
+    voiced = np.flatnonzero(energy > threshold)
+    if not len(voiced):
+        return []
+    pad = int(padding * SAMPLE_RATE / FRAME)
+    gap = int(min_silence * SAMPLE_RATE / FRAME)
+    regions = []
+    start = previous = voiced[0]
+    for frame in voiced[1:]:
+        if frame - previous > gap:
+            regions.append((start, previous))
+            start = frame
+        previous = frame
+    regions.append((start, previous))
+    return [(max(0, (first - pad) * FRAME), min(len(audio), (last + 1 + pad) * FRAME))
+            for first, last in regions]
+
+
+class SilenceTrimmer:
+    """Removes leading, trailing and long inner silences before whisper sees the audio.
+
+    Input is the 16 kHz mono float32 buffer from decode_audio. Keeps totals of
+    the audio removed and, from the measured transcription speed, an estimate
+    of the whisper time this saved.
+    """
+
+    def __init__(self, enabled: bool = True, margin_db: float = 10.0, min_silence: float = 0.5,
+                 padding: float = 0.2):
+        self.enabled = enabled
+        self.margin_db = margin_db
+        self.min_silence = min_silence
+        self.padding = padding
+        self._lock = threading.Lock()
+        self.clips = 0
+        self.input_seconds = 0.0
+        self.removed_seconds = 0.0
+        self.transcribed_seconds = 0.0
+        self.transcribe_time = 0.0
+
+    def trim(self, audio: np.ndarray) -> np.ndarray:
+        if not self.enabled:
+            return audio
+        regions = speech_regions(audio, self.margin_db, self.min_silence, self.padding)
+        # nothing loud enough: let whisper have the whole clip rather than nothing
+        trimmed = np.concatenate([audio[start:end] for start, end in regions]) if regions else audio
+        with self._lock:
+            self.clips += 1
+            self.input_seconds += len(audio) / SAMPLE_RATE
+            self.removed_seconds += (len(audio) - len(trimmed)) / SAMPLE_RATE
+        return trimmed
+
+    def record_transcription(self, audio_seconds: float, elapsed: float) -> None:
+        """Feed the transcription speed used to estimate the time saved."""
+        with self._lock:
+            self.transcribed_seconds += audio_seconds
+            self.transcribe_time += elapsed
+
+    def stats(self) -> Dict[str, float]:
+        # seconds of whisper time per second of audio, as measured so far
+        rate = self.transcribe_time / self.transcribed_seconds if self.transcribed_seconds else 0.0
+        return {
+            "clips": self.clips,
+            "input_seconds": round(self.input_seconds, 3),
+            "removed_seconds": round(self.removed_seconds, 3),
+            "removed_share": round(self.removed_seconds / self.input_seconds, 4) if self.input_seconds else 0.0,
+            "estimated_seconds_saved": round(self.removed_seconds * rate, 3),
+        }
+
+
+silence_trimmer = SilenceTrimmer(VAD_ENABLED, VAD_MARGIN_DB, VAD_MIN_SILENCE, VAD_PADDING)
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import logging
+import secrets
+import signal
+from http import HTTPStatus
+from typing import Optional
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from telegram import Update
+from telegram.ext import Application
+
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateHandler(tornado.web.RequestHandler):
+    """Receives the updates Telegram posts and queues them for the Application."""
+
+    # "application" is taken by tornado for its own Application
+    def initialize(self, bot_application: Application, secret_token: str) -> None:
+        self.bot_application = bot_application
+        self.secret_token = secret_token
+
+    async def post(self) -> None:
+        if not secrets.compare_digest(self.request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            self.set_status(HTTPStatus.FORBIDDEN)
+            return
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning("Invalid update received on the webhook: %s", e)
+            self.set_status(HTTPStatus.BAD_REQUEST)
+            return
+        await self.bot_application.update_queue.put(update)
+        self.set_status(HTTPStatus.OK)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    """/healthz answers as long as the process serves http, /readyz once updates are processed."""
+
+    def initialize(self, bot_application: Application, readiness: bool) -> None:
+        self.bot_application = bot_application
+        self.readiness = readiness
+
+    def get(self) -> None:
+        registry = self.bot_application.bot_data.get("whisper_registry")
+        ready = self.bot_application.running
+        if self.readiness and not ready:
+            self.set_status(HTTPStatus.SERVICE_UNAVAILABLE)
+        self.write({
+            "status": "ok" if ready or not self.readiness else "starting",
+            "running": ready,
+            "whisper_ready": bool(registry and registry.ready),
+        })
+
+
+def make_app(application: Application, path: str, secret_token: str) -> tornado.web.Application:
+    return tornado.web.Application([
+        (path, UpdateHandler, {"bot_application": application, "secret_token": secret_token}),
+        ("/healthz", HealthHandler, {"bot_application": application, "readiness": False}),
+        ("/readyz", HealthHandler, {"bot_application": application, "readiness": True}),
+    ])
+
+
+async def serve_webhook(application: Application, url: str, listen: str = "0.0.0.0",
+                        port: int = 8443, path: str = "/telegram", secret_token: str = "",
+                        max_connections: int = 40, stop: Optional[asyncio.Event] = None) -> None:
+    """Run the Application behind an embedded tornado server until `stop` is set.
+
+    Mirrors Application.run_polling: post_init, post_stop and post_shutdown are
+    called around the Application's own initialize/start/stop/shutdown.
+    """
+    secret_token = secret_token or secrets.token_urlsafe(32)
+    if stop is None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+    server = HTTPServer(make_app(application, path, secret_token), xheaders=True)
+    server.listen(port, address=listen)
+    logger.info("Webhook server listening on %s:%d%s", listen, port, path)
+    try:
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await application.bot.set_webhook(
+            url=url,
+            secret_token=secret_token,
+            max_connections=max_connections,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await stop.wait()
+    finally:
+        server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await server.close_all_connections()
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import WHISPER_BATCH_WINDOW, WHISPER_BATCH_SIZE
+from bot.audio import SAMPLE_RATE
+from bot.transcription import TranscriptionService, transcription_service
+from bot.model_policy import DecodingProfile
+
+logger = logging.getLogger(__name__)
+
+# whisper works on 30 s windows, longer clips can not share a batch
+MAX_BATCH_SAMPLES = 30 * SAMPLE_RATE
+
+BatchKey = Tuple[Optional[str], Optional[DecodingProfile]]
+
+
+def _transcribe_options(profile: Optional[DecodingProfile]) -> Dict[str, Any]:
+    return profile.transcribe_options() if profile is not None else {}
+
+
+class WhisperBatcher:
+    """Collects clips arriving within `window` seconds and transcribes them as one batch."""
+
+    def __init__(self, service: TranscriptionService, window: float = 0.05, max_batch: int = 8):
+        self.service = service
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[BatchKey, List[Tuple[np.ndarray, asyncio.Future]]] = {}
+        self._timers: Dict[BatchKey, asyncio.TimerHandle] = {}
+        self.batches = 0
+        self.batched_clips = 0
+
+    async def transcribe(self, audio: np.ndarray, size: Optional[str] = None,
+                         profile: Optional[DecodingProfile] = None) -> dict:
+        if self.max_batch <= 1 or len(audio) > MAX_BATCH_SAMPLES:
+            return await self.service.transcribe(audio, size, **_transcribe_options(profile))
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # only clips decoded the same way can share a pass
+        key = (size, profile)
+        batch = self._pending.setdefault(key, [])
+        batch.append((audio, future))
+        if len(batch) >= self.max_batch:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        return {"text": await future}
+
+    def _flush(self, key: BatchKey) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            asyncio.ensure_future(self._run(batch, *key))
+
+    async def _run(self, batch: List[Tuple[np.ndarray, asyncio.Future]], size: Optional[str],
+                   profile: Optional[DecodingProfile]) -> None:
+        try:
+            if len(batch) == 1:
+                # nothing to share the pass with, keep transcribe's temperature fallback
+                texts = [(await self.service.transcribe(batch[0][0], size,
+                                                        **_transcribe_options(profile)))["text"]]
+            else:
+                self.batches += 1
+                self.batched_clips += len(batch)
+                texts = await self.service.transcribe_batch(
+                    [clip for clip, _ in batch], size,
+                    **(profile.decode_options() if profile is not None else {}))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), text in zip(batch, texts):
+            if not future.done():
+                future.set_result(text)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "batched_clips": self.batched_clips,
+            "avg_batch_size": self.batched_clips / self.batches if self.batches else 0.0,
+        }
+
+
+whisper_batcher = WhisperBatcher(transcription_service, WHISPER_BATCH_WINDOW, WHISPER_BATCH_SIZE)
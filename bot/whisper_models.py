@@ -0,0 +1,151 @@
+import logging
+import os
+import queue
+import threading
+import warnings
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from bot.metrics import stage_metrics
+from config import (
+    WHISPER_MODELS,
+    WHISPER_DEFAULT_MODEL,
+    WHISPER_DEVICE,
+    WHISPER_REPLICAS,
+    WHISPER_QUANTIZE,
+    TORCH_THREADS,
+    TORCH_INTEROP_THREADS,
+)
+
+logger = logging.getLogger(__name__)
+
+# one second of silence at whisper's 16 kHz sample rate, enough to build every kernel once
+WARM_UP_AUDIO = np.zeros(16000, dtype=np.float32)
+
+
+def quantize_dynamic(model: Any) -> Any:
+    """Replace the model's Linear layers by dynamically quantized int8 ones (CPU only).
+
+    Whisper subclasses nn.Linear only to cast the weights to the input dtype,
+    which torch's quantization does not recognize, so they are turned back
+    into plain nn.Linear first. Weights are stored as int8 and activations
+    are quantized on the fly, roughly halving the model's memory.
+    """
+    import torch
+
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear):
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class WhisperModelRegistry:
+    """Loads every configured whisper model once and shares it with all the handlers."""
+
+    def __init__(self, sizes: Iterable[str], default: str, device: Optional[str] = None,
+                 replicas: int = 1, quantize: bool = False, torch_threads: int = 0,
+                 interop_threads: int = 0):
+        self.sizes = list(sizes)
+        self.default = default
+        self.device = device
+        self.replicas = max(1, replicas)
+        self.quantize = quantize
+        self.torch_threads = torch_threads
+        self.interop_threads = interop_threads
+        self._torch_configured = False
+        self.ready = False
+        self._models: Dict[str, List[Any]] = {}
+        self._free: Dict[str, queue.Queue] = {}
+        self._lock = threading.Lock()
+        self._thread_state = threading.local()
+
+    def load(self, size: str) -> Any:
+        """Return the model for `size`, loading and warming up its replicas on first use."""
+        with self._lock:
+            models = self._models.get(size)
+            if models is None:
+                # whisper pulls in torch, only pay for it once a model is actually needed
+                import whisper
+
+                self._configure_torch()
+                logger.info("Loading whisper model %r (%d replica(s))", size, self.replicas)
+                warnings.simplefilter("ignore")
+                models = []
+                free = queue.Queue()
+                with stage_metrics.time("whisper_load", model=size):
+                    for _ in range(self.replicas):
+                        model = whisper.load_model(size, device=self.device)
+                        if self.quantize and model.device.type == "cpu":
+                            model = quantize_dynamic(model)
+                        model.transcribe(WARM_UP_AUDIO, fp16=model.device.type != "cpu")
+                        models.append(model)
+                        free.put(model)
+                self._models[size] = models
+                self._free[size] = free
+                logger.info("Whisper model %r is ready", size)
+            return models[0]
+
+    def _configure_torch(self) -> None:
+        # inter-op threads can only be set before torch runs anything in parallel,
+        # so this happens right before the first model is loaded
+        if self._torch_configured:
+            return
+        import torch
+
+        torch.set_num_threads(self.threads)
+        if self.interop_threads:
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError as e:
+                logger.warning("Could not set the torch inter-op threads: %s", e)
+        self._torch_configured = True
+        logger.info("Torch uses %d intra-op and %d inter-op thread(s)", self.threads,
+                    torch.get_num_interop_threads())
+
+    @property
+    def threads(self) -> int:
+        """Intra-op threads of each transcription, 0 in config splits the cpus between replicas."""
+        return self.torch_threads or max(1, (os.cpu_count() or 1) // self.replicas)
+
+    def load_all(self) -> None:
+        for size in self.sizes:
+            self.load(size)
+        self.ready = True
+
+    def get(self, size: Optional[str] = None) -> Any:
+        size = size or self.default
+        models = self._models.get(size)
+        if models is None:
+            # sizes outside of the configured list are still served, just not preloaded
+            return self.load(size)
+        return models[0]
+
+    @contextmanager
+    def lease(self, size: Optional[str] = None) -> Iterator[Any]:
+        """Check out a replica for exclusive use.
+
+        Whisper installs kv-cache hooks on the model while decoding, so a single
+        instance must never run two transcriptions at the same time.
+        """
+        size = size or self.default
+        if size not in self._free:
+            self.load(size)
+        if not getattr(self._thread_state, "configured", False):
+            # the OpenMP thread count is per calling thread, set it on every worker thread
+            import torch
+
+            torch.set_num_threads(self.threads)
+            self._thread_state.configured = True
+        free = self._free[size]
+        model = free.get()
+        try:
+            yield model
+        finally:
+            free.put(model)
+
+
+whisper_registry = WhisperModelRegistry(WHISPER_MODELS, WHISPER_DEFAULT_MODEL, WHISPER_DEVICE,
+                                        WHISPER_REPLICAS, WHISPER_QUANTIZE, TORCH_THREADS,
+                                        TORCH_INTEROP_THREADS)
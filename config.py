@@ -1,3 +1,8 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
 menu_message = (
         "Welcome to the Bot!\n\n"
 
@@ -7,3 +12,179 @@ menu_message = (
         "\t/stop - Stop the bot."
     )
 
+
+def _get_list(name: str, default: str) -> list:
+    return [item.strip() for item in os.getenv(name, default).split(",") if item.strip()]
+
+
+# Whisper speech-to-text
+# comma separated model sizes loaded once at startup, e.g. "tiny,base"
+WHISPER_MODELS = _get_list("WHISPER_MODELS", "tiny")
+WHISPER_DEFAULT_MODEL = os.getenv("WHISPER_DEFAULT_MODEL", WHISPER_MODELS[0])
+# "cpu", "cuda", ... ; empty lets whisper pick
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE") or None
+# int8 dynamic quantization of the models' linear layers, only applied on cpu
+WHISPER_QUANTIZE = os.getenv("WHISPER_QUANTIZE", "false").lower() in ("1", "true", "yes")
+# when to load the models: "startup" before polling begins, "background" once
+# the bot is already answering, "lazy" on the first voice message
+WHISPER_PRELOAD = os.getenv("WHISPER_PRELOAD", "background")
+
+# Transcription worker pool
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "1"))
+# jobs allowed to wait for a free worker before new voice messages are refused
+TRANSCRIBE_QUEUE_SIZE = int(os.getenv("TRANSCRIBE_QUEUE_SIZE", "16"))
+# torch intra-op threads shared by the workers, 0 splits the cpu count between them
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))
+# torch inter-op threads, 0 keeps torch's default
+TORCH_INTEROP_THREADS = int(os.getenv("TORCH_INTEROP_THREADS", "0"))
+# copies of each whisper model, a model instance is only used by one worker at a time
+WHISPER_REPLICAS = int(os.getenv("WHISPER_REPLICAS", str(TRANSCRIBE_WORKERS)))
+
+# Voice messages are decoded in memory; above this size they are spilled to a
+# per-request temp file for ffmpeg instead of being piped through stdin
+AUDIO_SPILL_BYTES = int(os.getenv("AUDIO_SPILL_BYTES", str(8 * 1024 * 1024)))
+
+# Transcription cache
+TRANSCRIPTION_CACHE_BYTES = int(os.getenv("TRANSCRIPTION_CACHE_BYTES", str(16 * 1024 * 1024)))
+# sqlite file for the persistent tier, empty keeps the cache in memory only
+TRANSCRIPTION_CACHE_DB = os.getenv("TRANSCRIPTION_CACHE_DB", "")
+
+# Streaming answers: minimum seconds between two edits of the same message,
+# Telegram starts answering edits with RetryAfter above roughly one per second
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# OpenAI chat completions
+OPENAI_API_KEY = os.getenv("CHATGPT_API")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+# empty uses the public api
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# HTTP pool shared by every OpenAI call
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+# needs the optional "h2" package
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "false").lower() in ("1", "true", "yes")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+
+# Cache of chat completion answers shared by every user
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+# sqlite file for answers that should survive restarts, empty keeps them in memory only
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "")
+
+# Resilience of the OpenAI calls
+# seconds a chat call may take including its retries
+OPENAI_DEADLINE = float(os.getenv("OPENAI_DEADLINE", "45"))
+OPENAI_RETRIES = int(os.getenv("OPENAI_RETRIES", "3"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "8"))
+# send a duplicate request when the first one is slower than this many seconds,
+# "p95" uses the observed 95th percentile latency, empty disables hedging
+OPENAI_HEDGE_DELAY = os.getenv("OPENAI_HEDGE_DELAY", "")
+# consecutive upstream failures that open the circuit, and seconds it stays open
+OPENAI_BREAKER_THRESHOLD = int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5"))
+OPENAI_BREAKER_RESET = float(os.getenv("OPENAI_BREAKER_RESET", "30"))
+
+# Scheduling of the OpenAI calls, set the account limits; 0 disables a bucket
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "3500"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "90000"))
+OPENAI_MAX_IN_FLIGHT = int(os.getenv("OPENAI_MAX_IN_FLIGHT", "32"))
+
+# Micro-batching of short voice messages: clips arriving within the window are
+# transcribed together, up to the batch size. A size of 1 disables batching
+WHISPER_BATCH_WINDOW = float(os.getenv("WHISPER_BATCH_WINDOW", "0.05"))
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", "8"))
+
+# Telegram connection
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+# alternative Bot API server, e.g. "http://localhost:8081/bot"; empty uses api.telegram.org
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "")
+TELEGRAM_BASE_FILE_URL = os.getenv("TELEGRAM_BASE_FILE_URL", "")
+# "polling" or "webhook", the --mode command line option takes precedence
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Webhook mode
+# public https url Telegram posts the updates to, e.g. "https://bot.example.com/telegram"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# checked against the X-Telegram-Bot-Api-Secret-Token header, a random one is used when empty
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# simultaneous connections Telegram opens to the webhook (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Updates processed at the same time across different chats; updates of the
+# same chat/user are always handled one after the other
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+
+# Conversation and user_data persistence, empty keeps everything in memory only
+PERSISTENCE_DB = os.getenv("PERSISTENCE_DB", "")
+# seconds between two batched writes of the changed entries
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", "5"))
+
+# Session memory: user_data and conversation states of users idle for longer than
+# the TTL are dropped by a job running every SESSION_SWEEP_INTERVAL seconds
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+# transcripts and summaries kept across all sessions, least recently active users go first
+SESSION_MAX_TRANSCRIPT_BYTES = int(os.getenv("SESSION_MAX_TRANSCRIPT_BYTES", str(64 * 1024 * 1024)))
+
+# Metrics: Prometheus text format on http://<listen>:<port>/metrics in both polling
+# and webhook mode, 0 disables it; never served on the public webhook listener
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+# comma separated Telegram user ids allowed to use /stats
+ADMIN_USER_IDS = [int(user_id) for user_id in _get_list("ADMIN_USER_IDS", "")]
+
+# Profiling, off unless enabled here or with the admin /profile command
+PROFILING = os.getenv("PROFILING", "false").lower() in ("1", "true", "yes")
+# collapsed stack files (flamegraph.pl, speedscope) are written here
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# seconds between two samples of the event loop thread, and between two profile files
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))
+PROFILE_DUMP_INTERVAL = float(os.getenv("PROFILE_DUMP_INTERVAL", "60"))
+# the event loop not running for this many seconds is reported with its stack
+PROFILE_BLOCK_THRESHOLD = float(os.getenv("PROFILE_BLOCK_THRESHOLD", "0.1"))
+
+# Silence trimming before whisper: frames this many dB above the recording's noise
+# floor are speech, silences longer than VAD_MIN_SILENCE seconds are cut out and
+# VAD_PADDING seconds are kept around every speech region
+VAD_ENABLED = os.getenv("VAD_ENABLED", "true").lower() in ("1", "true", "yes")
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", "10"))
+VAD_MIN_SILENCE = float(os.getenv("VAD_MIN_SILENCE", "0.5"))
+VAD_PADDING = float(os.getenv("VAD_PADDING", "0.2"))
+
+# Voice notes longer than LONG_AUDIO_SECONDS (after silence trimming) are split into
+# chunks of at most LONG_AUDIO_CHUNK_SECONDS overlapping by LONG_AUDIO_OVERLAP seconds
+# and transcribed in parallel, the partial text is shown while they finish. 0 disables
+LONG_AUDIO_SECONDS = float(os.getenv("LONG_AUDIO_SECONDS", "60"))
+LONG_AUDIO_CHUNK_SECONDS = float(os.getenv("LONG_AUDIO_CHUNK_SECONDS", "30"))
+LONG_AUDIO_OVERLAP = float(os.getenv("LONG_AUDIO_OVERLAP", "1.0"))
+
+# Choice of whisper model and decoding profile per voice message: "adaptive" picks
+# from the queue depth, the clip length and the user's /quality setting, "fixed"
+# always uses WHISPER_DEFAULT_MODEL with whisper's default decoding
+WHISPER_POLICY = os.getenv("WHISPER_POLICY", "adaptive")
+# waiting jobs per worker from which every message gets the fastest model and profile
+WHISPER_BUSY_QUEUE = float(os.getenv("WHISPER_BUSY_QUEUE", "1"))
+# longest clip, in seconds, given the largest model and beam search when the node is idle
+WHISPER_IDLE_MAX_SECONDS = float(os.getenv("WHISPER_IDLE_MAX_SECONDS", "30"))
+# language code used unless the user set one, empty lets whisper detect it
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE", "") or None
+
+# Summaries of long transcriptions: texts over SUMMARY_CHUNK_TOKENS are split on
+# sentence boundaries into chunks of that many tokens, summarized at most
+# SUMMARY_CONCURRENCY at a time, and the partial summaries summarized again
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "2000"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+# answer length of each chunk summary
+SUMMARY_MAP_TOKENS = int(os.getenv("SUMMARY_MAP_TOKENS", "250"))
+
+# Conversation memory of the chat: the last MEMORY_TURNS exchanges, at most
+# MEMORY_RECENT_TOKENS tokens of them, are sent verbatim, older ones are folded
+# into a summary of at most MEMORY_SUMMARY_TOKENS tokens in the background
+MEMORY_TURNS = int(os.getenv("MEMORY_TURNS", "6"))
+MEMORY_RECENT_TOKENS = int(os.getenv("MEMORY_RECENT_TOKENS", "1500"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
@@ -1,21 +1,66 @@
 
 
-from openai import AsyncOpenAI
+import argparse
+import asyncio
 from dotenv import load_dotenv
 import os
 
-from pydub import AudioSegment
 import logging
 from telegram import Update
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, CallbackContext
-import speech_recognition as sr
+from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, TypeHandler, filters, CallbackContext
 
 from bot.start_handler import start
+from bot.utilities import chat, is_error
+from bot.openai_client import openai_provider, OPENAI_CLIENT
+from bot.audio import decode_pcm16, SAMPLE_RATE
 from bot.question_command import conv_handler
+from bot.whisper_models import whisper_registry
+from bot.transcription import transcription_service
+from bot.transcription_cache import transcription_cache
+from bot.response_cache import response_cache
+from bot.tokens import load_encoding
+from bot.usage import usage_tracker
+from bot.scheduler import llm_scheduler
+from bot.webhook import serve_webhook
+from bot.update_processor import update_processor
+from bot.persistence import SQLitePersistence
+from bot.sessions import session_sweeper
+from bot import metrics
+from bot.metrics import stage_metrics, start_metrics_server
+from bot.stats_command import stats
+from bot.profile_command import profile
+from bot.profiling import profiler
+from bot.vad import silence_trimmer
+from bot.long_audio import long_audio_transcriber
+from bot.model_policy import transcription_policy
+from bot.quality_command import quality
+from bot.summarizer import summarizer
+from bot.memory import conversation_memory
+from bot.memory_command import forget
+from bot.whisper_batching import whisper_batcher
+from bot.resilience import openai_resilience
+from config import (
+    WHISPER_PRELOAD,
+    TELEGRAM_TOKEN,
+    TELEGRAM_BASE_URL,
+    TELEGRAM_BASE_FILE_URL,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS,
+    PERSISTENCE_DB,
+    PERSISTENCE_FLUSH_INTERVAL,
+    SESSION_SWEEP_INTERVAL,
+    METRICS_PORT,
+    METRICS_LISTEN,
+    PROFILING,
+    OPENAI_MODEL,
+)
 
 load_dotenv()
-TOKEN = os.getenv("TELEGRAM_TOKEN")
-API_KEY = os.getenv("CHATGPT_API")
 dataDirPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
 
 
@@ -27,65 +72,162 @@ logging.basicConfig(
 
 
 
-client = AsyncOpenAI(api_key=API_KEY)
 # async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 #     await context.bot.send_message(chat_id=update.effective_chat.id, text="Hi, what's up?")
 
+@metrics.handler("echo")
 async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    ch = [
-        {"role": "user", "content": str(update.message.text)}
-    ]
-    response = await chat(MSGS=ch, MaxToken=500, outputs=3)
+    text = str(update.message.text)
+    # earlier exchanges of the chat, as a rolling summary and the last turns
+    ch = conversation_memory.messages(context.chat_data, text)
+    response = await chat(MSGS=ch, MaxToken=500, client=context.bot_data[OPENAI_CLIENT], user_id=update.effective_user.id)
     await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
+    if not is_error(response):
+        conversation_memory.record(update.effective_chat.id, context.chat_data, text, response,
+                                   context.bot_data[OPENAI_CLIENT], update.effective_user.id,
+                                   context.application)
 
 
+@metrics.handler("audio")
 async def audio(update: Update, context: CallbackContext) -> None:
+    import speech_recognition as sr
+
     file = await context.bot.get_file(update.message.voice)
-    await file.download_to_drive(os.path.join(dataDirPath,"user_audio.ogg"))
-    ogg_audio = AudioSegment.from_file(os.path.join(dataDirPath,"user_audio.ogg"), format="ogg")
-    ogg_audio.export(os.path.join(dataDirPath,"user_audio.wav"), format='wav')
+    pcm = await asyncio.to_thread(decode_pcm16, bytes(await file.download_as_bytearray()))
+    # raw 16-bit mono frames, no wav round-trip through the disk
+    audio_data = sr.AudioData(pcm, SAMPLE_RATE, 2)
     r = sr.Recognizer()
-    with sr.AudioFile(os.path.join(dataDirPath,"user_audio.wav")) as source:
-        audio_data = r.record(source)
-        text = r.recognize_google(audio_data)
+    text = r.recognize_google(audio_data)
     ch = [
         {"role": "user", "content": str(text)}
     ]
-    response = await chat(MSGS=ch, MaxToken=500, outputs=3)
+    response = await chat(MSGS=ch, MaxToken=500, client=context.bot_data[OPENAI_CLIENT], user_id=update.effective_user.id)
     await update.message.reply_text(response)
 
-async def chat(MSGS: list, MaxToken: int=50, outputs: int=3) -> str:
-    # We use the Chat Completion endpoint for chat like inputs
-    response = await client.chat.completions.create(
-    # gpt-4, gpt-4-0314, gpt-4-32k, gpt-4-32k-0314,
-    # gpt-3.5-turbo, gpt-3.5-turbo-0301
-    model="gpt-3.5-turbo",
-    # MSGS=[
-    #     {"role": "system", "content": "<message generated by system>"},
-    #     {"role": "user", "content": "<message generated by user>"},
-    #     {"role": "assistant", "content": "<message generated by assistant>"}
-    # ]
-    messages=MSGS,
-    # max_tokens generated by the AI model
-    # maximu value can be 4096 tokens for "gpt-3.5-turbo"
-    max_tokens = MaxToken,
-    # number of output variations to be generated by AI model
-    n = outputs,
+async def _preload_whisper() -> None:
+    try:
+        await asyncio.to_thread(whisper_registry.load_all)
+    except Exception:
+        logging.exception("Whisper preload failed, models will be loaded on first use")
+
+async def post_init(application) -> None:
+    application.bot_data["whisper_registry"] = whisper_registry
+    if WHISPER_PRELOAD == "startup":
+        # load and warm up every whisper model before the first update is handled
+        await asyncio.to_thread(whisper_registry.load_all)
+    elif WHISPER_PRELOAD == "background":
+        # answer /start right away, voice messages wait for the model if they come first
+        application.bot_data["whisper_preload"] = asyncio.create_task(_preload_whisper())
+    transcription_service.start()
+    application.bot_data["transcription_service"] = transcription_service
+    # token counts are estimated until the encoding, possibly downloaded, is ready
+    application.bot_data["tokenizer_preload"] = asyncio.create_task(
+        asyncio.to_thread(load_encoding, OPENAI_MODEL))
+    # one pooled client for every handler, so TLS connections are reused
+    application.bot_data[OPENAI_CLIENT] = openai_provider.start()
+    application.job_queue.run_repeating(session_sweeper.sweep, interval=SESSION_SWEEP_INTERVAL,
+                                        first=SESSION_SWEEP_INTERVAL, name="session_sweeper")
+    for component, collect in (
+        ("transcription", transcription_service.metrics),
+        ("whisper_batching", whisper_batcher.stats),
+        ("transcription_cache", transcription_cache.stats),
+        ("response_cache", response_cache.stats),
+        ("llm_scheduler", llm_scheduler.stats),
+        ("openai", openai_resilience.stats),
+        ("updates", update_processor.stats),
+        ("sessions", session_sweeper.stats),
+        ("profiler", profiler.stats),
+        ("vad", silence_trimmer.stats),
+        ("long_audio", long_audio_transcriber.stats),
+        ("whisper_policy", transcription_policy.stats),
+        ("summarizer", summarizer.stats),
+        ("memory", conversation_memory.stats),
+        ("usage", usage_tracker.stats),
+    ):
+        stage_metrics.register(component, collect)
+    if METRICS_PORT:
+        application.bot_data["metrics_server"] = start_metrics_server(METRICS_PORT, METRICS_LISTEN)
+    if PROFILING:
+        profiler.start()
+
+async def post_shutdown(application) -> None:
+    # writes the samples collected since the last profile file
+    profiler.stop()
+    metrics_server = application.bot_data.pop("metrics_server", None)
+    if metrics_server is not None:
+        metrics_server.stop()
+    for name in ("whisper_preload", "tokenizer_preload"):
+        preload = application.bot_data.pop(name, None)
+        if preload is not None:
+            await preload
+    # let running transcriptions finish, drop the ones still waiting
+    await asyncio.to_thread(transcription_service.shutdown)
+    transcription_cache.close()
+    conversation_memory.close()
+    await llm_scheduler.close()
+    await openai_provider.close()
+    await response_cache.close()
+    if isinstance(application.persistence, SQLitePersistence):
+        # Application.shutdown already flushed the last changes
+        application.persistence.close()
+
+def build_application(token: str = TELEGRAM_TOKEN, base_url: str = TELEGRAM_BASE_URL,
+                      base_file_url: str = TELEGRAM_BASE_FILE_URL):
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        # chats run in parallel, updates of the same chat stay in order
+        .concurrent_updates(update_processor)
     )
-    return response.choices[0].message.content
-
-if __name__ == '__main__':
-    application = ApplicationBuilder().token(TOKEN).build()
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    if PERSISTENCE_DB:
+        builder = builder.persistence(SQLitePersistence(PERSISTENCE_DB, PERSISTENCE_FLUSH_INTERVAL))
+    application = builder.build()
     start_handler = CommandHandler('start', start)
     # question_handler = CommandHandler("question", conv_handler)
-    # echo_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), echo)
+    echo_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), echo)
     # audio_handler = MessageHandler(filters.VOICE & ~filters.COMMAND, audio)
 
+    # records every user's last activity for the session sweeper, before any other handler
+    application.add_handler(TypeHandler(Update, session_sweeper.touch), group=-1)
     application.add_handler(start_handler)
-    # application.add_handler(echo_handler)
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("profile", profile))
+    application.add_handler(CommandHandler("quality", quality))
+    application.add_handler(CommandHandler("forget", forget))
     application.add_handler(conv_handler)
+    # free text outside /question is answered with the chat's memory, after the
+    # conversation so the texts it waits for still go to it
+    application.add_handler(echo_handler)
     # application.add_handler(question_handler)
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # no-ops until profiling is switched on
+    profiler.wrap_handlers(application)
+    return application
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Telegram OpenAI bot")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default=BOT_MODE)
+    parser.add_argument("--webhook-url", default=WEBHOOK_URL)
+    parser.add_argument("--listen", default=WEBHOOK_LISTEN)
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    parser.add_argument("--max-connections", type=int, default=WEBHOOK_MAX_CONNECTIONS)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    application = build_application()
+    if args.mode == "webhook":
+        if not args.webhook_url:
+            raise SystemExit("webhook mode needs WEBHOOK_URL or --webhook-url")
+        asyncio.run(serve_webhook(application, args.webhook_url, args.listen, args.port,
+                                  WEBHOOK_PATH, WEBHOOK_SECRET, args.max_connections))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 
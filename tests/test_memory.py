@@ -0,0 +1,49 @@
+import unittest
+from unittest import mock
+
+from bot import memory as memory_module
+from bot.memory import MEMORY, ConversationMemory
+from bot.tokens import context_window, count_message_tokens
+
+MODEL = "gpt-3.5-turbo"
+
+
+class Application:
+    def __init__(self):
+        self.marked = []
+
+    def mark_data_for_update_persistence(self, chat_ids=None, user_ids=None):
+        self.marked.append(chat_ids)
+
+
+def exchange(words: int):
+    return [{"role": "user", "content": "word " * words}, {"role": "assistant", "content": "answer"}]
+
+
+class RefreshTest(unittest.IsolatedAsyncioTestCase):
+    async def test_backlog_is_folded_in_prompts_that_fit(self):
+        memory = ConversationMemory(turns=6, recent_tokens=200, summary_tokens=300, model=MODEL)
+        budget = context_window(MODEL) - memory.summary_tokens
+        prompts = []
+
+        async def chat(MSGS, **kwargs):
+            prompts.append(count_message_tokens(MSGS, MODEL))
+            return "the summary"
+
+        # left by failed refreshes: more than one window's worth, one exchange over it alone
+        chat_data = {MEMORY: {"summary": "", "turns": [],
+                              "pending": [exchange(1500), exchange(1500), exchange(5000)]}}
+        application = Application()
+        with mock.patch.object(memory_module, "chat", chat):
+            memory.record(1, chat_data, "last question", "answer", object(), 1, application)
+            await memory.wait()
+
+        self.assertGreater(len(prompts), 1)
+        self.assertTrue(all(tokens <= budget for tokens in prompts), prompts)
+        self.assertEqual(chat_data[MEMORY]["pending"], [])
+        self.assertEqual(chat_data[MEMORY]["summary"], "the summary")
+        self.assertEqual(application.marked, [1] * len(prompts))
+
+
+if __name__ == "__main__":
+    unittest.main()
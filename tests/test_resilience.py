@@ -0,0 +1,126 @@
+import asyncio
+import unittest
+
+import httpx
+import openai
+
+from bot.resilience import CircuitBreaker, CircuitOpenError, ResilientCaller, retry_after
+from bot.scheduler import LLMScheduler
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def status_error(status: int) -> openai.APIStatusError:
+    response = httpx.Response(status, request=REQUEST)
+    error = openai.InternalServerError if status >= 500 else openai.BadRequestError
+    return error(f"status {status}", response=response, body=None)
+
+
+def failing(status: int):
+    async def request():
+        raise status_error(status)
+    return request
+
+
+async def healthy():
+    return "ok"
+
+
+class CircuitBreakerTrialTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(threshold=2, reset_timeout=0.01)
+        self.caller = ResilientCaller(retries=0, breaker=self.breaker)
+
+    async def open_circuit(self):
+        for _ in range(2):
+            with self.assertRaises(openai.InternalServerError):
+                await self.caller.call(failing(500), hedge=False)
+        self.assertEqual(self.breaker.state, "open")
+        await asyncio.sleep(0.02)
+        self.assertEqual(self.breaker.state, "half-open")
+
+    async def test_non_retryable_trial_closes_the_circuit(self):
+        await self.open_circuit()
+        with self.assertRaises(openai.BadRequestError):
+            await self.caller.call(failing(400), hedge=False)
+        # upstream answered the trial, it is healthy
+        self.assertEqual(self.breaker.state, "closed")
+        self.assertEqual(await self.caller.call(healthy, hedge=False), "ok")
+
+    async def test_cancelled_trial_lets_the_next_call_try(self):
+        await self.open_circuit()
+
+        async def slow():
+            await asyncio.sleep(10)
+
+        trial = asyncio.ensure_future(self.caller.call(slow, hedge=False))
+        await asyncio.sleep(0)
+        # only one trial at a time while it runs
+        with self.assertRaises(CircuitOpenError):
+            await self.caller.call(healthy, hedge=False)
+        trial.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await trial
+        self.assertEqual(await self.caller.call(healthy, hedge=False), "ok")
+        self.assertEqual(self.breaker.state, "closed")
+
+    async def test_local_error_in_trial_releases_it(self):
+        await self.open_circuit()
+
+        async def broken():
+            raise ValueError("bad arguments")
+
+        with self.assertRaises(ValueError):
+            await self.caller.call(broken, hedge=False)
+        self.assertEqual(await self.caller.call(healthy, hedge=False), "ok")
+
+
+class RetryChargingTest(unittest.IsolatedAsyncioTestCase):
+    async def test_retries_take_scheduler_capacity(self):
+        # 2 requests a minute: the admission takes one, the retry the other
+        scheduler = LLMScheduler(rpm=2, tpm=0, max_in_flight=4)
+        caller = ResilientCaller(retries=3, backoff_base=0, breaker=CircuitBreaker(threshold=100))
+        attempts = 0
+
+        async def throttled():
+            nonlocal attempts
+            attempts += 1
+            raise status_error(429)
+
+        async with scheduler.slot(1, 10) as slot:
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(caller.call(throttled, hedge=False, slot=slot), 0.5)
+        # the third attempt waits for a bucket refill instead of hitting OpenAI
+        self.assertEqual(attempts, 2)
+        self.assertEqual(scheduler.extra_attempts, 1)
+        await scheduler.close()
+
+
+class DeadlineTest(unittest.IsolatedAsyncioTestCase):
+    def test_unparsable_retry_after_is_ignored(self):
+        for value in ("soon", "Mon, 99 Foo 2024 25:00:00 GMT"):
+            response = httpx.Response(429, request=REQUEST, headers={"retry-after": value})
+            error = openai.RateLimitError("slow down", response=response, body=None)
+            self.assertIsNone(retry_after(error))
+
+    async def test_queue_wait_counts_against_the_deadline(self):
+        # one request a minute, the second caller can only wait for the refill
+        scheduler = LLMScheduler(rpm=1, tpm=0, max_in_flight=4)
+        breaker = CircuitBreaker(threshold=1)
+        caller = ResilientCaller(deadline=0.1, breaker=breaker)
+        async with scheduler.slot(1, 10):
+            pass
+        give_up_at = asyncio.get_running_loop().time() + caller.deadline
+        with self.assertRaises(asyncio.TimeoutError):
+            async with scheduler.slot(2, 10, timeout=caller.deadline) as slot:
+                await caller.call(healthy, hedge=False, slot=slot, give_up_at=give_up_at)
+        # the deadline already spent is not held against upstream
+        with self.assertRaises(asyncio.TimeoutError):
+            await caller.call(healthy, hedge=False, give_up_at=give_up_at)
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(scheduler.stats()["queued"], 0)
+        await scheduler.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from bot.response_cache import ResponseCache, SQLiteStore
+
+
+class StreamCoalescingTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = ResponseCache(ttl=60, max_entries=10)
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        return ["called"]
+
+    async def test_chat_waits_on_the_stream_in_flight(self):
+        lead = await self.cache.get_or_lead("key")
+        self.assertIsInstance(lead, asyncio.Future)
+        follower = asyncio.ensure_future(self.cache.get_or_call("key", self.call))
+        other_stream = asyncio.ensure_future(self.cache.get_or_lead("key"))
+        await asyncio.sleep(0)
+        self.cache.settle("key", lead, ["streamed"])
+        self.assertEqual(await follower, ["streamed"])
+        self.assertEqual(await other_stream, ["streamed"])
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(self.cache.stats()["coalesced"], 2)
+        self.assertEqual(self.cache.get("key"), ["streamed"])
+
+    async def test_given_up_stream_lets_the_waiter_call(self):
+        lead = await self.cache.get_or_lead("key")
+        follower = asyncio.ensure_future(self.cache.get_or_call("key", self.call))
+        await asyncio.sleep(0)
+        self.cache.settle("key", lead, None)
+        self.assertEqual(await follower, ["called"])
+        self.assertEqual(self.calls, 1)
+
+    async def test_cancelled_waiter_does_not_cancel_the_stream(self):
+        lead = await self.cache.get_or_lead("key")
+        follower = asyncio.ensure_future(self.cache.get_or_call("key", self.call))
+        await asyncio.sleep(0)
+        follower.cancel()
+        await asyncio.sleep(0)
+        self.assertFalse(lead.cancelled())
+        self.cache.settle("key", lead, ["streamed"])
+        self.assertEqual(self.cache.get("key"), ["streamed"])
+
+
+class StoreWriteTest(unittest.IsolatedAsyncioTestCase):
+    async def test_put_is_written_by_close(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "responses.db")
+            cache = ResponseCache(ttl=60, max_entries=10, store=SQLiteStore(path))
+            cache.put("key", ["answer"])
+            await cache.close()
+            store = SQLiteStore(path)
+            self.assertEqual(store.get("key")[0], ["answer"])
+            store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from telegram.ext import ApplicationBuilder, CommandHandler, ConversationHandler
+
+from bot.model_policy import LANGUAGE, QUALITY
+from bot.sessions import SessionSweeper
+
+
+async def noop(update, context):
+    pass
+
+
+class SweepTest(unittest.TestCase):
+    def setUp(self):
+        self.application = ApplicationBuilder().token("1:test").build()
+        self.conversation = ConversationHandler([CommandHandler("question", noop)], {}, [])
+        self.application.add_handler(self.conversation)
+        self.sweeper = SessionSweeper(idle_ttl=-1, max_transcript_bytes=10 ** 6)
+
+    def test_idle_session_keeps_the_preferences(self):
+        self.application.user_data[1].update({QUALITY: "best", LANGUAGE: "fr",
+                                              "transcription": "x" * 100, "summary": "s"})
+        self.application.user_data[2].update({"transcription": "y" * 100})
+        self.conversation._conversations[(1, 1)] = 0
+
+        self.assertEqual(sorted(self.sweeper.sweep_application(self.application)), [1, 2])
+        self.assertEqual(self.application.user_data[1], {QUALITY: "best", LANGUAGE: "fr"})
+        self.assertNotIn(2, self.application.user_data)
+        self.assertEqual(self.sweeper.stats()["conversations"], 0)
+        # nothing left to evict, the user is not swept again
+        self.assertEqual(self.sweeper.sweep_application(self.application), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from bot import question_command
+from bot.openai_client import OPENAI_CLIENT
+from bot.streaming import MAX_MESSAGE_LENGTH
+
+LONG_TRANSCRIPTION = "word " * 1200
+
+
+class SummaryViewTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.edits = []
+
+        async def edit_message_text(text, **kwargs):
+            self.edits.append(text)
+
+        async def answer():
+            pass
+
+        self.update = SimpleNamespace(
+            callback_query=SimpleNamespace(answer=answer, edit_message_text=edit_message_text),
+            effective_chat=SimpleNamespace(id=1), effective_user=SimpleNamespace(id=1))
+        self.context = SimpleNamespace(user_data={"transcription": LONG_TRANSCRIPTION}, chat_data={},
+                                       bot_data={OPENAI_CLIENT: None}, application=None)
+
+    def assert_fits(self, summary):
+        self.assertTrue(self.edits)
+        for text in self.edits:
+            self.assertLessEqual(len(text), MAX_MESSAGE_LENGTH)
+        self.assertTrue(self.edits[-1].endswith(summary))
+
+    async def test_streamed_summary_is_not_cut_off(self):
+        self.assertGreater(len(LONG_TRANSCRIPTION), MAX_MESSAGE_LENGTH)
+
+        async def stream(text, **kwargs):
+            for _ in range(50):
+                yield "summary "
+
+        with mock.patch.object(question_command.summarizer, "stream", stream), \
+                mock.patch.object(question_command.conversation_memory, "record"):
+            await question_command.show_transcription_summary(self.update, self.context)
+        self.assert_fits("summary " * 50)
+        self.assertEqual(self.context.user_data["summary"], "summary " * 50)
+
+    async def test_cached_summary_fits(self):
+        self.context.user_data["summary"] = "the summary"
+        await question_command.show_transcription_summary(self.update, self.context)
+        self.assert_fits("the summary")
+
+
+if __name__ == "__main__":
+    unittest.main()